@@ -1,159 +1,2370 @@
+__version__ = "1.1.0"
+
 import argparse
+import ast
+import csv
+import hashlib
+import heapq
+import io
+import json
 import os
-from icalendar import Calendar, Event
-from icalendar.prop import vRecur
-from datetime import datetime, timedelta
-
-# Function to create the .ics file
-def create_ics(events, output_file, exceptions=[]):
-    cal = Calendar()
-    # Convert exceptions to a set of dates for easy lookup
-    exception_dates = set()
-    for exception in exceptions:
-        start_date = datetime.strptime(exception["date_start"], "%d.%m.%Y").date()
-        end_date = datetime.strptime(exception["date_end"], "%d.%m.%Y").date()
-        current_date = start_date
-        while current_date <= end_date:
-            exception_dates.add(current_date)
-            current_date += timedelta(days=1)
-
-    for event in events:
-        if "dates" in event:  # If the event has multiple specific dates
-            for date_str in event["dates"]:
-                event_date = datetime.strptime(date_str, "%d.%m.%Y").date()
-                if event_date in exception_dates:
-                    continue
-                ical_event = Event()
-                ical_event.add("summary", event["summary"], parameters={"CHARSET": "UTF-8"})
-                if "description" in event:
-                    ical_event.add("description", event["description"], parameters={"CHARSET": "UTF-8"})
-                if "start_time" in event and "end_time" in event:
-                    start_datetime = datetime.strptime(date_str + " " + event["start_time"], "%d.%m.%Y %H:%M")
-                    end_datetime = datetime.strptime(date_str + " " + event["end_time"], "%d.%m.%Y %H:%M")
-                    ical_event.add("dtstart", start_datetime)
-                    ical_event.add("dtend", end_datetime)
-                else:
-                    ical_event.add("dtstart", event_date)
-                    ical_event.add("dtend", event_date + timedelta(days=1))  # All-day event ends next day
-
-                cal.add_component(ical_event)
-
-        elif "date_start" in event and "date_end" in event:
-            # Multi-day event
-            start_date = datetime.strptime(event["date_start"], "%d.%m.%Y").date()
-            end_date = datetime.strptime(event["date_end"], "%d.%m.%Y").date()
-
-            ical_event = Event()
-            ical_event.add("summary", event["summary"], parameters={"CHARSET": "UTF-8"})
-            if "description" in event:
-                ical_event.add("description", event["description"], parameters={"CHARSET": "UTF-8"})
-            if "start_time" in event and "end_time" in event:
-                start_datetime = datetime.combine(start_date, datetime.strptime(event["start_time"], "%H:%M").time())
-                end_datetime = datetime.combine(end_date, datetime.strptime(event["end_time"], "%H:%M").time())
-                ical_event.add("dtstart", start_datetime)
-                ical_event.add("dtend", end_datetime)
-                exdates = [datetime.combine(date, start_datetime.time()) for date in exception_dates if start_date <= date <= end_date]
+import sys
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque, namedtuple
+from contextlib import ExitStack, contextmanager, nullcontext
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from itertools import chain, islice
+from time import perf_counter
+import re
+
+# icalendar, dateutil, concurrent.futures, cProfile and http.server are imported where they are
+# used, so --help, --check and runs that fail early don't pay for importing them.
+
+
+# Parsing of the fixed input formats. The same date and time strings show up over and over
+# (every exception bound, every date of every event), so results are memoized in a bounded cache.
+PARSE_CACHE_SIZE = 4096
+DATE_PATTERN = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{4})", re.ASCII)
+TIME_PATTERN = re.compile(r"(\d{1,2}):(\d{1,2})", re.ASCII)
+
+
+# Parse a DD.MM.YYYY date string
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_date(value):
+    match = DATE_PATTERN.fullmatch(value) if isinstance(value, str) else None
+    if match is None:
+        raise ValueError(f"Invalid date {value!r}: expected DD.MM.YYYY")
+    day, month, year = match.groups()
+    try:
+        return date(int(year), int(month), int(day))
+    except ValueError as e:
+        raise ValueError(f"Invalid date {value!r}: {e}") from None
+
+
+# Parse an HH:MM time string (24 hour notation). Like strptime, one-digit hours and minutes are fine.
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_time(value):
+    match = TIME_PATTERN.fullmatch(value) if isinstance(value, str) else None
+    if match is None:
+        raise ValueError(f"Invalid time {value!r}: expected HH:MM")
+    hour, minute = match.groups()
+    try:
+        return time(int(hour), int(minute))
+    except ValueError as e:
+        raise ValueError(f"Invalid time {value!r}: {e}") from None
+
+
+# Sorted, merged index of exception date ranges.
+# Overlapping and adjacent ranges are merged on construction, so the index holds
+# one interval per contiguous block of exception days instead of one entry per day.
+# Membership and range queries are bisect lookups over the interval starts/ends.
+class ExceptionIndex:
+    def __init__(self, ranges=()):
+        intervals = sorted((start.toordinal(), end.toordinal()) for start, end in ranges if start <= end)
+        self.starts = []
+        self.ends = []
+        for start, end in intervals:
+            # Merge into the previous interval if it overlaps or touches it
+            if self.ends and start <= self.ends[-1] + 1:
+                if end > self.ends[-1]:
+                    self.ends[-1] = end
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    # Build the index from the "exceptions" array of the input file
+    @classmethod
+    def from_exceptions(cls, exceptions):
+        ranges = []
+        for exception in exceptions:
+            start_date = parse_date(exception["date_start"])
+            end_date = parse_date(exception["date_end"])
+            ranges.append((start_date, end_date))
+        return cls(ranges)
+
+    def __bool__(self):
+        return bool(self.starts)
+
+    def __len__(self):
+        # Number of exception days covered by the index
+        return sum(end - start + 1 for start, end in zip(self.starts, self.ends))
+
+    # Last exception day in the index, or None if it is empty
+    def last_date(self):
+        return date.fromordinal(self.ends[-1]) if self.ends else None
+
+    def __contains__(self, day):
+        ordinal = day.toordinal()
+        i = bisect_right(self.starts, ordinal) - 1
+        return i >= 0 and ordinal <= self.ends[i]
+
+    # Yield the (start, end) day ordinals of the exception intervals overlapping [first, last],
+    # clipped to that range. Either bound may be None for an open-ended query.
+    def intervals_between(self, first=None, last=None):
+        lo = first.toordinal() if first is not None else None
+        hi = last.toordinal() if last is not None else None
+        # First interval that ends on or after the lower bound
+        i = bisect_left(self.ends, lo) if lo is not None else 0
+        for start, end in zip(self.starts[i:], self.ends[i:]):
+            if hi is not None and start > hi:
+                break
+            if lo is not None and start < lo:
+                start = lo
+            if hi is not None and end > hi:
+                end = hi
+            yield start, end
+
+    # Yield every exception day in [first, last] in ascending order.
+    # Either bound may be None for an open-ended query.
+    def dates_between(self, first=None, last=None):
+        for start, end in self.intervals_between(first, last):
+            for ordinal in range(start, end + 1):
+                yield date.fromordinal(ordinal)
+
+
+# Vectorized handling of long "dates" lists. With NumPy installed, a list of at least
+# VECTORIZE_MIN_DATES dates is parsed into a datetime64[D] array in bulk and its exception days
+# are found with one searchsorted over the exception intervals, instead of parsing and looking
+# up every date on its own. Shorter lists, lists that aren't all in strict DD.MM.YYYY form and
+# installs without NumPy take the plain Python path, which also produces the error messages.
+VECTORIZE_MIN_DATES = 1000
+# date.toordinal() of the datetime64 epoch, 1970-01-01
+EPOCH_ORDINAL = 719163
+
+
+# NumPy if it is installed, else None. It is optional and only imported when first needed.
+@lru_cache(maxsize=None)
+def numpy_module():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+# Parse DD.MM.YYYY strings into a datetime64[D] array, or return None if any of them isn't a
+# valid date in exactly that form
+def parse_dates_array(np, date_strings):
+    strings = np.array(date_strings)
+    if strings.dtype != np.dtype("<U10") or strings.ndim != 1:
+        return None
+    try:
+        raw = np.frombuffer(strings.astype("S10").tobytes(), dtype=np.uint8).reshape(-1, 10)
+    except UnicodeEncodeError:
+        return None
+    digits = raw[:, [0, 1, 3, 4, 6, 7, 8, 9]].astype(np.int64) - ord("0")
+    if not ((raw[:, 2] == ord(".")) & (raw[:, 5] == ord(".")) & (digits >= 0).all(axis=1) & (digits <= 9).all(axis=1)).all():
+        return None
+    day = digits[:, 0] * 10 + digits[:, 1]
+    month = digits[:, 2] * 10 + digits[:, 3]
+    year = digits[:, 4] * 1000 + digits[:, 5] * 100 + digits[:, 6] * 10 + digits[:, 7]
+    if not ((year >= 1) & (month >= 1) & (month <= 12) & (day >= 1)).all():
+        return None
+    month_start = ((year - 1970) * 12 + month - 1).astype("datetime64[M]")
+    month_length = ((month_start + 1).astype("datetime64[D]") - month_start.astype("datetime64[D]")).astype(np.int64)
+    if (day > month_length).any():
+        return None
+    return month_start.astype("datetime64[D]") + (day - 1)
+
+
+# Boolean mask of the days (a datetime64[D] array) that fall on an exception day
+def exception_mask(np, days, exception_dates):
+    ordinals = days.astype(np.int64) + EPOCH_ORDINAL
+    starts = np.array(exception_dates.starts, dtype=np.int64)
+    ends = np.array(exception_dates.ends, dtype=np.int64)
+    # Last interval starting on or before each day; the day is excluded if that interval reaches it
+    i = np.searchsorted(starts, ordinals, side="right") - 1
+    return (i >= 0) & (ordinals <= ends[np.maximum(i, 0)])
+
+
+# Parse a "dates" list: into a datetime64[D] array when the vectorized path applies, else
+# into a list of dates
+def parse_dates(date_strings):
+    np = numpy_module() if len(date_strings) >= VECTORIZE_MIN_DATES else None
+    days = parse_dates_array(np, date_strings) if np is not None else None
+    return days if days is not None else list(map(parse_date, date_strings))
+
+
+# Drop the exception days from parsed dates. Returns (kept dates, number of dates dropped).
+# The kept dates are in list order, or with unique, deduplicated and sorted.
+def drop_exception_days(days, exception_dates, unique=False):
+    if isinstance(days, list):
+        if unique:
+            days = sorted(set(days))
+        kept = [day for day in days if day not in exception_dates]
+        return kept, len(days) - len(kept)
+    np = numpy_module()
+    if unique:
+        days = np.unique(days)
+    if not exception_dates:
+        return days.astype(object).tolist(), 0
+    excluded = exception_mask(np, days, exception_dates)
+    return days[~excluded].astype(object).tolist(), int(excluded.sum())
+
+
+# Upper bound on how many occurrences of a single rule are expanded when pruning EXDATEs.
+# Past this point every remaining exception day is emitted, as without pruning.
+MAX_EXPANDED_OCCURRENCES = 10000
+
+
+# RRULE parts of an input "recurrence" object, with UNTIL parsed. INTERVAL defaults to 1, as in RFC 5545.
+def recurrence_rrule(recurrence):
+    rrule = {"FREQ": recurrence["freq"], "INTERVAL": recurrence.get("interval", 1)}
+    if "count" in recurrence:
+        rrule["COUNT"] = recurrence["count"]  # Number of occurrences
+    if "until" in recurrence:
+        rrule["UNTIL"] = parse_date(recurrence["until"])
+    return rrule
+
+
+# Exception days that actually hit an occurrence of a recurrence rule (RRULE parts).
+# The rule is expanded lazily and only as far as the last exception day, UNTIL or COUNT,
+# whichever comes first, so unbounded rules stay cheap.
+def rrule_exdates(event_date, rrule, exception_dates):
+    last_exception = exception_dates.last_date()
+    if last_exception is None or last_exception < event_date:
+        return []
+    until_date = rrule.get("UNTIL")
+    stop_date = last_exception if until_date is None else min(until_date, last_exception)
+
+    from dateutil import rrule as dateutil_rrule
+    occurrences = dateutil_rrule.rrule(
+        getattr(dateutil_rrule, rrule["FREQ"].upper()),
+        dtstart=datetime.combine(event_date, datetime.min.time()),
+        interval=rrule["INTERVAL"],
+        count=rrule.get("COUNT"),
+    )
+    exdates = []
+    expanded = 0
+    for occurrence in occurrences:
+        day = occurrence.date()
+        if day > stop_date:
+            return exdates
+        if day in exception_dates:
+            exdates.append(day)
+        expanded += 1
+        if expanded >= MAX_EXPANDED_OCCURRENCES:
+            break
+    else:
+        # The rule ran out of occurrences (COUNT) before reaching the last exception
+        return exdates
+
+    # Expansion cap reached: fall back to every remaining exception day in range
+    exdates.extend(exception_dates.dates_between(day + timedelta(days=1), stop_date))
+    return exdates
+
+
+# Everything that ends up in one VEVENT. dtstart/dtend are dates for all-day events and
+# datetimes for timed ones; rrule is a dict of RRULE parts, exdates and rdates lists of dates/datetimes.
+VEventData = namedtuple("VEventData",
+                        ["summary", "description", "dtstart", "dtend", "rrule", "exdates", "rdates", "uid"],
+                        defaults=[None, None])
+
+
+# Keys of an input event that describe it. Anything else in the dict is ignored.
+EVENT_KEYS = ("summary", "description", "date", "date_start", "date_end", "dates", "start_time", "end_time", "recurrence")
+UID_DOMAIN = "ical-creator"
+
+
+# Canonical JSON form of an event's content: known keys only, in a fixed order
+def event_content(event):
+    return json.dumps({key: event[key] for key in EVENT_KEYS if key in event},
+                      sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+# Stable UID derived from the event's content, so regenerating a calendar keeps UIDs
+# unchanged and subscribed clients update events instead of replacing them
+def event_uid(event):
+    digest = hashlib.sha256(event_content(event).encode("utf-8")).hexdigest()[:32]
+    return f"{digest}@{UID_DOMAIN}"
+
+
+# Identical events have the same UID, but the UIDs of one calendar have to be unique. The first
+# of them keeps it, the second gets "-2" appended to its local part, the third "-3" and so on.
+# uid_counts holds the number of events seen so far per UID, for one calendar.
+def unique_uid(uid, uid_counts):
+    n = uid_counts[uid] = uid_counts.get(uid, 0) + 1
+    if n == 1:
+        return uid
+    local, domain = uid.split("@")
+    return f"{local}-{n}@{domain}"
+
+
+# A normalized event with a UID made unique in its calendar (see unique_uid)
+def unique_event(event, uid_counts):
+    uid = unique_uid(event.uid, uid_counts)
+    return event if uid is event.uid else event._replace(uid=uid)
+
+
+# Per-stage timings and counters of one run, as reported by --stats.
+# Stages nest: while an inner stage runs, the outer one is paused, so every second is charged
+# to exactly one stage even when lazy loading, building, serializing and writing interleave.
+class Stats:
+    STAGES = ("load", "exceptions", "cache", "build", "serialize", "write")
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.timings = {}
+        self.counters = {}
+        self.active = []
+        self.since = None
+
+    # Charge the time since the last switch to the innermost running stage
+    def switch(self):
+        now = perf_counter()
+        if self.active:
+            name = self.active[-1]
+            self.timings[name] = self.timings.get(name, 0.0) + now - self.since
+        self.since = now
+
+    @contextmanager
+    def stage(self, name):
+        self.switch()
+        self.active.append(name)
+        try:
+            yield
+        finally:
+            self.switch()
+            self.active.pop()
+
+    # Pass the items of an iterable through, charging the time spent producing each one to a stage
+    def iterate(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                item = next(iterator, self)
+            if item is self:
+                return
+            yield item
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    # Add the stats collected elsewhere (e.g. in a worker process), with their timings under a prefix
+    def merge(self, other, prefix=""):
+        for name, seconds in other["timings"].items():
+            self.timings[prefix + name] = self.timings.get(prefix + name, 0.0) + seconds
+        for name, n in other["counters"].items():
+            self.count(name, n)
+
+    def as_dict(self):
+        return {
+            "total": perf_counter() - self.started,
+            "timings": dict(self.timings),
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    def report(self):
+        data = self.as_dict()
+        known = [name for name in self.STAGES if name in data["timings"]]
+        names = known + sorted(name for name in data["timings"] if name not in known)
+        lines = ["Stage timings:"]
+        lines += [f"  {name:<20} {data['timings'][name]:10.3f}s" for name in names]
+        lines.append(f"  {'total':<20} {data['total']:10.3f}s")
+        lines.append("Counters:")
+        lines += [f"  {name:<20} {n:10d}" for name, n in data["counters"].items()]
+        return "\n".join(lines)
+
+
+# stats.stage(name), or a no-op without stats
+def stage(stats, name):
+    return nullcontext() if stats is None else stats.stage(name)
+
+
+# stats.iterate(name, iterable), or the iterable itself without stats
+def timed(stats, name, iterable):
+    return iterable if stats is None else stats.iterate(name, iterable)
+
+
+# Which branch of event_vevent_data an event takes
+def event_shape(event):
+    if "dates" in event:
+        return "dates"
+    if "date_start" in event and "date_end" in event:
+        return "multi_day"
+    if "recurrence" in event:
+        return "recurrence"
+    return "single_day"
+
+
+# An input event, normalized once before any VEVENT is generated: dates and times parsed, and
+# whichever date keys it has reduced to the same fields. Compact tuples instead of dicts.
+# shape is one of "single_day", "multi_day", "dates" or "recurrence" (see event_shape).
+# start/end are its first and last day (inclusive) for every shape but "dates", whose parsed
+# dates are in dates instead (a datetime64[D] array for long lists, see parse_dates).
+# start_time/end_time are None for all-day events; rrule holds the RRULE parts of recurrences.
+NormalizedEvent = namedtuple("NormalizedEvent", ["shape", "summary", "description", "uid", "start", "end", "dates",
+                                                 "start_time", "end_time", "rrule"])
+
+
+# Normalize one input event. NormalizedEvents are returned as they are.
+def normalize_event(event):
+    if isinstance(event, NormalizedEvent):
+        return event
+    shape = event_shape(event)
+    start = end = dates = rrule = None
+    if shape == "dates":
+        dates = parse_dates(event["dates"])
+    elif shape == "multi_day":
+        start = parse_date(event["date_start"])
+        end = parse_date(event["date_end"])
+    else:
+        start = end = parse_date(event["date"])
+        if shape == "recurrence":
+            rrule = recurrence_rrule(event["recurrence"])
+    # Times are parsed once per event and reused for all of its dates
+    start_time = end_time = None
+    if "start_time" in event and "end_time" in event:
+        start_time = parse_time(event["start_time"])
+        end_time = parse_time(event["end_time"])
+    return NormalizedEvent(shape, event["summary"], event.get("description"), event_uid(event), start, end, dates,
+                           start_time, end_time, rrule)
+
+
+# The VEventData of a normalized event's VEVENT from day start to day end (inclusive).
+# exception_days and extra_days become EXDATEs and RDATEs, at the event's start time if it has one.
+def vevent_data(event, start, end, uid, rrule=None, exception_days=None, extra_days=None):
+    if event.start_time is None:
+        # All-day events end (exclusively) the day after their last day
+        return VEventData(event.summary, event.description, start, end + timedelta(days=1), rrule,
+                          exception_days, extra_days, uid)
+    start_time = event.start_time
+    if exception_days is not None:
+        exception_days = [datetime.combine(day, start_time) for day in exception_days]
+    if extra_days is not None:
+        extra_days = [datetime.combine(day, start_time) for day in extra_days]
+    return VEventData(event.summary, event.description, datetime.combine(start, start_time),
+                      datetime.combine(end, event.end_time), rrule, exception_days, extra_days, uid)
+
+
+# Generate the data for each VEVENT of one input event, raw or normalized.
+# With prune_exdates, recurring events only get EXDATEs for exception days that fall on
+# one of their occurrences rather than every exception day after the start date.
+# With compact_dates, an event with a "dates" list becomes a single VEVENT whose DTSTART is the
+# earliest date and whose RDATE lists the others, instead of one VEVENT per date.
+# Dates dropped because of an exception are counted in stats, if given.
+def event_vevent_data(event, exception_dates, prune_exdates=False, compact_dates=False, stats=None):
+    event = normalize_event(event)
+
+    if event.shape == "dates":
+        days, skipped = drop_exception_days(event.dates, exception_dates, unique=compact_dates)
+        if stats is not None:
+            stats.count("occurrences_skipped", skipped)
+        if compact_dates:
+            # Exceptions are filtered out up front, so no EXDATEs are needed
+            if days:
+                yield vevent_data(event, days[0], days[0], event.uid, extra_days=days[1:])
+        else:
+            # Each date is its own VEVENT, so each one needs its own UID, even a date given twice
+            uid_prefix = event.uid.split("@")[0]
+            uid_counts = {}
+            for day in days:
+                uid = unique_uid(f"{uid_prefix}-{day:%Y%m%d}@{UID_DOMAIN}", uid_counts)
+                yield vevent_data(event, day, day, uid)
+
+    elif event.shape == "single_day":
+        if event.start in exception_dates:
+            if stats is not None:
+                stats.count("occurrences_skipped")
+            return
+        yield vevent_data(event, event.start, event.end, event.uid)
+
+    else:
+        # Multi-day and recurring events stay one VEVENT, with EXDATEs for their exception days
+        if event.shape == "multi_day":
+            exception_days = list(exception_dates.dates_between(event.start, event.end))
+        elif prune_exdates:
+            exception_days = rrule_exdates(event.start, event.rrule, exception_dates)
+        else:
+            exception_days = list(exception_dates.dates_between(event.start))
+        yield vevent_data(event, event.start, event.end, event.uid, event.rrule, exception_days)
+
+
+# Generate the data for each VEVENT of the events array, one at a time.
+# The events are taken as one calendar, so identical ones get distinct UIDs (see unique_uid).
+# See event_vevent_data for prune_exdates and compact_dates.
+# With stats, reading events is timed as "load" and generating VEVENTs as "build", and events
+# per branch, VEVENTs, occurrences (DTSTART plus RDATEs; a recurring VEVENT counts once) and
+# EXDATEs are counted.
+def iter_vevent_data(events, exception_dates, prune_exdates=False, compact_dates=False, stats=None):
+    uid_counts = {}
+    if stats is None:
+        for event in events:
+            event = unique_event(normalize_event(event), uid_counts)
+            yield from event_vevent_data(event, exception_dates, prune_exdates, compact_dates)
+        return
+    for event in stats.iterate("load", events):
+        with stats.stage("build"):
+            event = unique_event(normalize_event(event), uid_counts)
+        stats.count("events_" + event.shape)
+        vevents = event_vevent_data(event, exception_dates, prune_exdates, compact_dates, stats)
+        for data in stats.iterate("build", vevents):
+            count_vevent(stats, data)
+            yield data
+
+
+# Count one VEVENT's data in stats, as iter_vevent_data does
+def count_vevent(stats, data):
+    stats.count("vevents")
+    stats.count("occurrences", 1 + len(data.rdates or ()))
+    stats.count("exdates", len(data.exdates or ()))
+
+
+# Build the icalendar Event for one VEVENT
+def to_ical_event(data):
+    from icalendar import Event
+    from icalendar.prop import vRecur
+    ical_event = Event()
+    ical_event.add("summary", data.summary, parameters={"CHARSET": "UTF-8"})
+    if data.description is not None:
+        ical_event.add("description", data.description, parameters={"CHARSET": "UTF-8"})
+    ical_event.add("dtstart", data.dtstart)
+    ical_event.add("dtend", data.dtend)
+    if data.uid is not None:
+        ical_event.add("uid", data.uid)
+    if data.rrule:
+        ical_event.add("rrule", vRecur(data.rrule))
+    if data.rdates:
+        ical_event.add("rdate", data.rdates)
+    if data.exdates:
+        ical_event.add("exdate", data.exdates)
+    return ical_event
+
+
+# Native serializer for the handful of properties this tool emits.
+# It writes content lines directly instead of going through icalendar's property objects,
+# using the same property order, TEXT escaping and value formats as icalendar.
+
+# Order in which icalendar writes the RRULE parts we use
+RRULE_PART_ORDER = ("FREQ", "UNTIL", "COUNT", "INTERVAL")
+
+
+# Escape a TEXT value (RFC 5545, section 3.3.11)
+def escape_text(text):
+    return (
+        text.replace("\\N", "\n")
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+        .replace("\r", "\\n")
+    )
+
+
+# Fold an encoded content line the way icalendar does (RFC 5545, section 3.1): physical lines
+# carry at most 74 octets of content, continuation lines start with a space, and lines are
+# never split inside a UTF-8 sequence or directly after a backslash or caret, so escapes stay whole.
+def fold_line(line):
+    if len(line) < 75:
+        return line + b"\r\n"
+    parts = []
+    start = 0
+    while len(line) - start > 74:
+        end = start + 74
+        # Back off to the start of a multi-byte character
+        while line[end] & 0xC0 == 0x80:
+            end -= 1
+        if line[end - 1] in b"\\^" and end - 1 > start:
+            end -= 1
+        parts.append(line[start:end])
+        start = end
+    parts.append(line[start:])
+    return b"\r\n ".join(parts) + b"\r\n"
+
+
+def format_date_value(value):
+    if isinstance(value, datetime):
+        return value.strftime("%Y%m%dT%H%M%S")
+    return value.strftime("%Y%m%d")
+
+
+# Property name plus VALUE=DATE parameter if the value is a plain date
+def date_property(name, value):
+    if isinstance(value, datetime):
+        return name + ":"
+    return name + ";VALUE=DATE:"
+
+
+def format_rrule(rrule):
+    parts = []
+    for key in RRULE_PART_ORDER:
+        if key in rrule:
+            value = rrule[key]
+            if key == "UNTIL":
+                value = format_date_value(value)
+            elif key == "FREQ":
+                value = value.upper()
+            parts.append(f"{key}={value}")
+    return ";".join(parts)
+
+
+# Serialize one VEVENT to bytes without icalendar
+def serialize_vevent(data):
+    lines = [
+        "BEGIN:VEVENT",
+        "SUMMARY;CHARSET=UTF-8:" + escape_text(data.summary),
+        date_property("DTSTART", data.dtstart) + format_date_value(data.dtstart),
+        date_property("DTEND", data.dtend) + format_date_value(data.dtend),
+    ]
+    if data.uid is not None:
+        lines.append("UID:" + escape_text(data.uid))
+    if data.rrule:
+        lines.append("RRULE:" + format_rrule(data.rrule))
+    if data.rdates:
+        lines.append(date_property("RDATE", data.rdates[0]) + ",".join(format_date_value(day) for day in data.rdates))
+    if data.exdates:
+        lines.append(date_property("EXDATE", data.exdates[0]) + ",".join(format_date_value(day) for day in data.exdates))
+    if data.description is not None:
+        lines.append("DESCRIPTION;CHARSET=UTF-8:" + escape_text(data.description))
+    lines.append("END:VEVENT")
+    return b"".join(fold_line(line.encode("utf-8")) for line in lines)
+
+
+# Serializers turning VEventData into the bytes of one VEVENT
+SERIALIZERS = {
+    "icalendar": lambda data: to_ical_event(data).to_ical(),
+    "native": serialize_vevent,
+}
+
+
+# The calendar wrapper around the VEVENTs, as icalendar serializes an empty Calendar
+CALENDAR_HEADER = b"BEGIN:VCALENDAR\r\n"
+CALENDAR_FOOTER = b"END:VCALENDAR\r\n"
+
+
+# Write a calendar to a binary file object one serialized VEVENT at a time.
+# Each chunk is written as soon as it is produced, so memory use does not grow with the
+# number of events. With stats, writes are timed as "write" and the bytes written counted.
+def write_calendar_stream(f, chunks, stats=None):
+    if stats is None:
+        f.write(CALENDAR_HEADER)
+        for chunk in chunks:
+            f.write(chunk)
+        f.write(CALENDAR_FOOTER)
+        return
+    written = 0
+    for chunk in chain((CALENDAR_HEADER,), chunks, (CALENDAR_FOOTER,)):
+        with stats.stage("write"):
+            f.write(chunk)
+        written += len(chunk)
+    stats.count("bytes_written", written)
+
+
+# First and last day of the exceptions that can change a normalized event's VEVENTs; last is
+# None when exceptions of any later day count. That is every day it can occur on, except for
+# recurrences: without prune_exdates they get an EXDATE for every exception day after their
+# start, however far after UNTIL, and with it for those up to UNTIL.
+# Returns None for an event without any dates.
+def event_span(event, prune_exdates=False):
+    if event.shape == "dates":
+        if len(event.dates) == 0:
+            return None
+        first, last = min(event.dates), max(event.dates)
+        if not isinstance(first, date):
+            # datetime64[D] values of the vectorized path
+            first, last = first.astype(object), last.astype(object)
+        return first, last
+    if event.shape == "recurrence":
+        return event.start, event.rrule.get("UNTIL") if prune_exdates else None
+    return event.start, event.end
+
+
+# On-disk cache of serialized VEVENTs. Entries are keyed by a hash of the event's content,
+# the exception intervals that can affect it (see event_span) and the options that shape its output, so only
+# events that changed (or whose exceptions changed) are serialized again.
+# Each entry also keeps the event's counters (see iter_vevent_data), so --stats reports the
+# same numbers whether or not the event came from the cache.
+# The cache is one file per output calendar; saving it keeps only the entries used by the
+# latest run, and a cache written by another version of this tool is ignored.
+# Only an index of the file is held in memory: an entry is read when it's hit, and each entry
+# used by the run goes straight to the new cache file, which save() moves into place (or
+# discard() drops, if the run fails).
+class VEventCache:
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.entries = self.read()
+        self.temp_file = f"{self.path}.{os.getpid()}.tmp"
+        self.file = None
+        self.new_file = None
+
+    # Index of the cache file: the offset of each entry, by key
+    def read(self):
+        try:
+            with open(self.path, "rb") as f:
+                if f.readline() != CACHE_HEADER:
+                    return {}
+                size = os.fstat(f.fileno()).st_size
+                entries = {}
+                offset = f.tell()
+                for line in iter(f.readline, b""):
+                    key, length, counters = line.split()
+                    end = offset + len(line) + int(length)
+                    if end > size:
+                        return {}
+                    entries[bytes.fromhex(key.decode("ascii"))] = offset
+                    f.seek(end)
+                    offset = end
+                return entries
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            # Truncated or otherwise unreadable cache: start over
+            return {}
+
+    # The line and serialized VEVENTs of the entry at offset, or None if it isn't the entry of
+    # key (when another run replaced the cache file since it was indexed)
+    def read_entry(self, key, offset):
+        if self.file is None:
+            self.file = open(self.path, "rb")
+        self.file.seek(offset)
+        line = self.file.readline()
+        try:
+            entry_key, length, _ = line.split()
+            if bytes.fromhex(entry_key.decode("ascii")) != key:
+                return None
+            length = int(length)
+        except ValueError:
+            return None
+        chunk = self.file.read(length)
+        return (line, chunk) if len(chunk) == length else None
+
+    # Key of a normalized event (by its unique UID, which is a hash of its content), given the
+    # options [serializer, prune_exdates, compact_dates]
+    @staticmethod
+    def key(normalized, exception_dates, options):
+        span = event_span(normalized, prune_exdates=options[1])
+        intervals = list(exception_dates.intervals_between(*span)) if span else []
+        content = json.dumps([normalized.uid, intervals, options], separators=(",", ":"))
+        return hashlib.sha256(content.encode("utf-8")).digest()
+
+    # The serialized VEVENTs and counters of an entry, or None
+    def get(self, key):
+        offset = self.entries.get(key)
+        entry = None if offset is None else self.read_entry(key, offset)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        line, chunk = entry
+        self.write(line, chunk)
+        counters = line.split()[2].decode("ascii")
+        return chunk, {name: int(n) for name, n in (counter.split("=") for counter in counters.split(","))}
+
+    def put(self, key, chunk, counters):
+        counters = ",".join(f"{name}={n}" for name, n in counters.items())
+        self.write(f"{key.hex()} {len(chunk)} {counters}\n".encode("ascii"), chunk)
+
+    # Append an entry to the new cache file, which is created on the first one
+    def write(self, line, chunk):
+        if self.new_file is None:
+            self.create()
+        self.new_file.write(line)
+        self.new_file.write(chunk)
+
+    def create(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.new_file = open(self.temp_file, "wb")
+        self.new_file.write(CACHE_HEADER)
+
+    def save(self):
+        if self.new_file is None:
+            self.create()
+        self.close()
+        os.replace(self.temp_file, self.path)
+
+    def discard(self):
+        self.close()
+        if os.path.exists(self.temp_file):
+            os.remove(self.temp_file)
+
+    def close(self):
+        for f in (self.file, self.new_file):
+            if f is not None:
+                f.close()
+        self.file = self.new_file = None
+
+    def stats(self):
+        return f"{self.hits} hits, {self.misses} misses"
+
+
+CACHE_HEADER = f"ical-creator VEVENT cache {__version__}\n".encode("ascii")
+
+
+# Default directory for VEVENT caches, following the XDG base directory convention
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "ical-creator")
+
+
+# Cache file for one output calendar
+def cache_path(cache_dir, output_file):
+    name = hashlib.sha256(os.path.abspath(output_file).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, name + ".cache")
+
+
+# All VEVENTs of one input event, serialized
+def serialize_event(event, exception_dates, serializer, prune_exdates=False, compact_dates=False, stats=None):
+    serialize = SERIALIZERS[serializer]
+    vevents = iter_vevent_data((event,), exception_dates, prune_exdates, compact_dates, stats)
+    return b"".join(timed(stats, "serialize", map(serialize, vevents)))
+
+
+# serialize_event for a normalized event, also returning the event's counters (as counted by
+# iter_vevent_data) for the cache. They are counted whether or not there are stats, which
+# only time the work and get the counters added.
+def serialize_counted(event, exception_dates, serializer, prune_exdates=False, compact_dates=False, stats=None):
+    counts = Stats()
+    counts.count("events_" + event.shape)
+    with stage(stats, "build"):
+        vevents = list(event_vevent_data(event, exception_dates, prune_exdates, compact_dates, counts))
+    for data in vevents:
+        count_vevent(counts, data)
+    with stage(stats, "serialize"):
+        chunk = b"".join(map(SERIALIZERS[serializer], vevents))
+    add_counters(stats, counts.counters)
+    return chunk, counts.counters
+
+
+# Add counters, e.g. those of a cached event, to stats, if given
+def add_counters(stats, counters):
+    if stats is not None:
+        for name, n in counters.items():
+            stats.count(name, n)
+
+
+# Serialized VEVENTs per input event, taken from the cache when possible
+def iter_cached_chunks(events, exception_dates, serializer, cache, prune_exdates=False, compact_dates=False,
+                       stats=None):
+    options = [serializer, prune_exdates, compact_dates]
+    uid_counts = {}
+    for event in timed(stats, "load", events):
+        with stage(stats, "cache"):
+            # Normalized once, for the key and, on a miss, for serializing
+            normalized = unique_event(normalize_event(event), uid_counts)
+            key = cache.key(normalized, exception_dates, options)
+            entry = cache.get(key)
+        if entry is None:
+            chunk, counters = serialize_counted(normalized, exception_dates, serializer, prune_exdates,
+                                                compact_dates, stats)
+            cache.put(key, chunk, counters)
+        else:
+            chunk, counters = entry
+            add_counters(stats, counters)
+        yield chunk
+
+
+# Parallel serialization. Events are split into chunks of PARALLEL_CHUNK_SIZE, which worker
+# processes serialize while the parent writes finished chunks in their original order.
+# The exception index and options are handed to each worker once, when it starts.
+PARALLEL_CHUNK_SIZE = 500
+worker_state = None
+
+
+def init_worker(exception_dates, serializer, prune_exdates, compact_dates, collect_stats=False, count_events=False):
+    global worker_state
+    worker_state = (exception_dates, serializer, prune_exdates, compact_dates, collect_stats, count_events)
+
+
+# Worker side: serialize a list of events, one bytes chunk per event. Returns the chunks, the
+# counters of each event if the parent caches them, and, if the parent collects stats, the
+# worker's stats for them.
+def serialize_events(events):
+    exception_dates, serializer, prune_exdates, compact_dates, collect_stats, count_events = worker_state
+    stats = Stats() if collect_stats else None
+    if not count_events:
+        chunks = [serialize_event(event, exception_dates, serializer, prune_exdates, compact_dates, stats)
+                  for event in events]
+        return chunks, None, stats.as_dict() if stats is not None else None
+    results = [serialize_counted(event, exception_dates, serializer, prune_exdates, compact_dates, stats)
+               for event in events]
+    return ([chunk for chunk, _ in results], [counters for _, counters in results],
+            stats.as_dict() if stats is not None else None)
+
+
+# Serialized VEVENTs per input event, produced by a pool of worker processes.
+# Only a bounded number of chunks is in flight at any time, so lazily loaded events are
+# never all held in memory. With a cache, hits are resolved here and only misses are sent out.
+# With stats, time spent waiting for workers counts as "serialize", and the workers' own
+# timings are added up under "worker_*".
+def iter_parallel_chunks(events, exception_dates, serializer, workers, cache=None, prune_exdates=False,
+                         compact_dates=False, chunk_size=None, stats=None):
+    from concurrent.futures import ProcessPoolExecutor
+    chunk_size = chunk_size or PARALLEL_CHUNK_SIZE
+    options = [serializer, prune_exdates, compact_dates]
+    events = iter(timed(stats, "load", events))
+    pending = deque()
+    uid_counts = {}
+
+    # Chunks of one batch: cached ones as they are, the others filled in from the worker's results
+    def finish(keys, cached, future):
+        with stage(stats, "serialize"):
+            results, counters, worker_stats = future.result()
+        if worker_stats is not None:
+            stats.merge(worker_stats, "worker_")
+        results = iter(results)
+        counters = iter(counters or ())
+        for i, entry in enumerate(cached):
+            if entry is None:
+                chunk = next(results)
+                if cache is not None:
+                    cache.put(keys[i], chunk, next(counters))
             else:
-                ical_event.add("dtstart", start_date)
-                ical_event.add("dtend", end_date + timedelta(days=1))  # End date is exclusive
-                exdates = [date for date in exception_dates if start_date <= date <= end_date]
-
-            if exdates:
-                ical_event.add("exdate", exdates)
-
-            cal.add_component(ical_event)
-
-        elif "recurrence" in event:
-            # Handle recurring events
-            ical_event = Event()
-            ical_event.add("summary", event["summary"], parameters={"CHARSET": "UTF-8"})
-            if "description" in event:
-                ical_event.add("description", event["description"], parameters={"CHARSET": "UTF-8"})
-            event_date = datetime.strptime(event["date"], "%d.%m.%Y").date()
-            if "start_time" in event and "end_time" in event:
-                start_datetime = datetime.combine(event_date, datetime.strptime(event["start_time"], "%H:%M").time())
-                end_datetime = datetime.combine(event_date, datetime.strptime(event["end_time"], "%H:%M").time())
-                ical_event.add("dtstart", start_datetime)
-                ical_event.add("dtend", end_datetime)
-                exdates = [datetime.combine(date, start_datetime.time()) for date in exception_dates if date >= event_date]
+                chunk, event_counters = entry
+                add_counters(stats, event_counters)
+            yield chunk
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(exception_dates, serializer, prune_exdates, compact_dates,
+                                       stats is not None, cache is not None)) as pool:
+        while True:
+            batch = list(islice(events, chunk_size))
+            if not batch:
+                break
+            # Events are normalized here, where duplicates can be told apart (see unique_uid), and
+            # workers get them already normalized
+            with stage(stats, "build"):
+                normalized = [unique_event(normalize_event(event), uid_counts) for event in batch]
+            if cache is not None:
+                with stage(stats, "cache"):
+                    keys = [cache.key(event, exception_dates, options) for event in normalized]
+                    cached = [cache.get(key) for key in keys]
             else:
-                ical_event.add("dtstart", event_date)
-                ical_event.add("dtend", event_date + timedelta(days=1))  # All-day event ends next day
-                exdates = [date for date in exception_dates if date >= event_date]
-
-            # Add recurrence rule
-            rrule = vRecur(freq=event["recurrence"]["freq"], interval=event["recurrence"]["interval"])
-            if "count" in event["recurrence"]:
-                rrule['COUNT'] = event["recurrence"]["count"]  # Number of occurrences
-            if "until" in event["recurrence"]:
-                until_date = datetime.strptime(event["recurrence"]["until"], "%d.%m.%Y").date()
-                rrule['UNTIL'] = until_date
-
-            ical_event.add("rrule", rrule)
-            if exdates:
-                ical_event.add("exdate", exdates)
-
-            cal.add_component(ical_event)
-
-        else:
-            # Single-day event
-            event_date = datetime.strptime(event["date"], "%d.%m.%Y").date()
-            if event_date not in exception_dates:
-                ical_event = Event()
-                ical_event.add("summary", event["summary"], parameters={"CHARSET": "UTF-8"})
-                if "description" in event:
-                    ical_event.add("description", event["description"], parameters={"CHARSET": "UTF-8"})
-                if "start_time" in event and "end_time" in event:
-                    start_datetime = datetime.combine(event_date, datetime.strptime(event["start_time"], "%H:%M").time())
-                    end_datetime = datetime.combine(event_date, datetime.strptime(event["end_time"], "%H:%M").time())
-                    ical_event.add("dtstart", start_datetime)
-                    ical_event.add("dtend", end_datetime)
+                keys = None
+                cached = [None] * len(batch)
+            misses = [event for event, entry in zip(normalized, cached) if entry is None]
+            pending.append((keys, cached, pool.submit(serialize_events, misses)))
+            while len(pending) >= 2 * workers:
+                yield from finish(*pending.popleft())
+        while pending:
+            yield from finish(*pending.popleft())
+
+
+# An output file written atomically: everything goes to a temporary file next to it, which only
+# replaces the output once the calendar is complete, so readers never see a half-written file and
+# a crash leaves the old one in place. If the new content is the same as the existing file's, the
+# output is left alone, mtime included, so polling clients and caches don't download it again.
+# With gzip_output, a <output>.gz copy is written alongside (with a fixed timestamp in its header,
+# so unchanged content gives identical bytes); with digest_file, a <output>.sha256 file holds the
+# SHA-256 of the content in sha256sum format, ready to use as an ETag.
+# changed tells, after a successful write, whether the output file was actually replaced.
+class AtomicOutput:
+    def __init__(self, path, gzip_output=False, digest_file=False):
+        self.path = path
+        self.gzip_output = gzip_output
+        self.digest_file = digest_file
+        self.changed = None
+
+    def __enter__(self):
+        self.temp_file = f"{self.path}.{os.getpid()}.tmp"
+        self.file = open(self.temp_file, "wb")
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.compressor = None
+        if self.gzip_output:
+            import zlib
+            self.gzip_temp_file = f"{self.path}.gz.{os.getpid()}.tmp"
+            self.gzip_file = open(self.gzip_temp_file, "wb")
+            # wbits=31 writes the gzip format, with a zero timestamp and no file name in the header
+            self.compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+        return self
+
+    def write(self, data):
+        self.file.write(data)
+        self.digest.update(data)
+        self.size += len(data)
+        if self.compressor is not None:
+            self.gzip_file.write(self.compressor.compress(data))
+
+    # Close the temporary files for now, keeping everything else, until resume() reopens them.
+    # Lets a caller writing many outputs at once stay below the open file limit.
+    def suspend(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            if self.compressor is not None:
+                self.gzip_file.close()
+
+    def resume(self):
+        self.file = open(self.temp_file, "ab")
+        if self.compressor is not None:
+            self.gzip_file = open(self.gzip_temp_file, "ab")
+
+    def __exit__(self, exc_type, exc, tb):
+        temp_files = [self.temp_file]
+        if self.file is None:
+            self.resume()
+        self.close(self.file)
+        if self.compressor is not None:
+            temp_files.append(self.gzip_temp_file)
+            self.gzip_file.write(self.compressor.flush())
+            self.close(self.gzip_file)
+        if exc_type is not None:
+            for temp_file in temp_files:
+                os.remove(temp_file)
+            return
+        digest = self.digest.hexdigest()
+        self.changed = self.existing_digest() != digest
+        self.commit(self.temp_file, self.path)
+        if self.compressor is not None:
+            self.commit(self.gzip_temp_file, self.path + ".gz")
+        if self.digest_file:
+            content = f"{digest}  {os.path.basename(self.path)}\n".encode("ascii")
+            if self.changed or not os.path.exists(self.path + ".sha256"):
+                with open(self.temp_file, "wb") as f:
+                    f.write(content)
+                self.commit(self.temp_file, self.path + ".sha256")
+
+    # Flush a temporary file to disk before it is closed, so a rename can't expose unwritten data
+    @staticmethod
+    def close(f):
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+    # SHA-256 of the existing output file, or None if there is none or it can't be the same size
+    def existing_digest(self):
+        try:
+            if os.path.getsize(self.path) != self.size:
+                return None
+            digest = hashlib.sha256()
+            with open(self.path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        except OSError:
+            return None
+        return digest.hexdigest()
+
+    # Move a finished temporary file into place, or drop it if the content didn't change and
+    # the target already exists
+    def commit(self, temp_file, path):
+        if self.changed or not os.path.exists(path):
+            os.replace(temp_file, path)
+        else:
+            os.remove(temp_file)
+
+
+# Open the output for writing: a path is written atomically (see AtomicOutput), a binary file
+# object is used as it is
+def open_output(output_file, gzip_output=False, digest_file=False):
+    if hasattr(output_file, "write"):
+        return nullcontext(output_file)
+    return AtomicOutput(output_file, gzip_output, digest_file)
+
+
+# Function to create the .ics file. output_file is a path or a binary file object.
+# By default the whole icalendar Calendar is built in memory and serialized in one go; with
+# streaming, VEVENTs are written out as they are produced instead. Both give identical output.
+# serializer picks how each VEVENT is turned into bytes: "icalendar", or the faster "native"
+# serializer, which always writes VEVENT by VEVENT.
+# With a VEventCache, serialized events are reused from earlier runs and the cache is saved afterwards.
+# With workers > 1, events are serialized in that many worker processes; the output is the same.
+# See event_vevent_data for prune_exdates and compact_dates, and AtomicOutput for how a path is
+# written and for gzip_output and digest_file (both ignored for file objects).
+# With shard_by ("year" or "month"), the calendar is split into one file per period instead,
+# see write_shards; the VEVENT cache isn't used then, and workers aren't supported.
+# With a Stats object, each stage of the run is timed and its counters filled in (see Stats).
+# Returns whether the output changed: False if an output file already had exactly this content.
+def create_ics(events, output_file, exceptions=[], prune_exdates=False, streaming=False, serializer="icalendar",
+               compact_dates=False, cache=None, workers=1, gzip_output=False, digest_file=False, shard_by=None,
+               stats=None):
+    if serializer not in SERIALIZERS:
+        raise ValueError(f"Unknown serializer {serializer!r}, expected one of: {', '.join(SERIALIZERS)}")
+    if shard_by is not None:
+        if shard_by not in SHARD_PERIODS:
+            raise ValueError(f"Unknown shard period {shard_by!r}, expected one of: {', '.join(SHARD_PERIODS)}")
+        if workers > 1:
+            raise ValueError("Sharded output can't be written by several workers")
+        if hasattr(output_file, "write"):
+            raise ValueError("Sharded output needs an output file name, not a file object")
+    # Index the exception ranges for cheap membership and range lookups
+    with stage(stats, "exceptions"):
+        exception_dates = ExceptionIndex.from_exceptions(exceptions)
+    if stats is not None:
+        stats.count("exception_days", len(exception_dates))
+
+    if shard_by is not None:
+        vevents = iter_vevent_data(events, exception_dates, prune_exdates, compact_dates, stats)
+        return write_shards(vevents, output_file, shard_by, SERIALIZERS[serializer], gzip_output, digest_file, stats)
+
+    output = open_output(output_file, gzip_output, digest_file)
+
+    if workers > 1 or cache is not None:
+        if workers > 1:
+            chunks = iter_parallel_chunks(events, exception_dates, serializer, workers, cache, prune_exdates,
+                                          compact_dates, stats=stats)
+        else:
+            chunks = iter_cached_chunks(events, exception_dates, serializer, cache, prune_exdates, compact_dates,
+                                        stats)
+        try:
+            with output as f:
+                write_calendar_stream(f, chunks, stats)
+        except BaseException:
+            if cache is not None:
+                cache.discard()
+            raise
+        if cache is not None:
+            with stage(stats, "cache"):
+                cache.save()
+            if stats is not None:
+                stats.count("cache_hits", cache.hits)
+                stats.count("cache_misses", cache.misses)
+
+    elif streaming or serializer != "icalendar":
+        vevents = iter_vevent_data(events, exception_dates, prune_exdates, compact_dates, stats)
+        serialize = SERIALIZERS[serializer]
+        with output as f:
+            write_calendar_stream(f, timed(stats, "serialize", map(serialize, vevents)), stats)
+
+    else:
+        from icalendar import Calendar
+        cal = Calendar()
+        for data in iter_vevent_data(events, exception_dates, prune_exdates, compact_dates, stats):
+            with stage(stats, "build"):
+                cal.add_component(to_ical_event(data))
+        with stage(stats, "serialize"):
+            content = cal.to_ical()
+        with output as f:
+            with stage(stats, "write"):
+                f.write(content)
+        if stats is not None:
+            stats.count("bytes_written", len(content))
+
+    return not isinstance(output, AtomicOutput) or output.changed
+
+
+# Sharded output: one calendar per year or month, for clients that choke on huge calendars.
+# Each VEVENT goes into the shard of its DTSTART. That includes recurring events, events with
+# RDATEs (compact_dates) and multi-day events running into the next period: they are kept
+# whole in the shard they start in rather than clipped, so each of them is in exactly one shard,
+# and a client that imports only a later shard doesn't see them.
+
+# strftime format of the period (and file name suffix) of each shard_by value
+SHARD_PERIODS = {"year": "%Y", "month": "%Y-%m"}
+
+
+# File name of the shard for a period: calendar.ics → calendar-2024.ics
+def shard_path(output_file, period):
+    root, ext = os.path.splitext(output_file)
+    return f"{root}-{period}{ext or '.ics'}"
+
+
+# File name of the shard index: calendar.ics → calendar.index.json
+def shard_index_path(output_file):
+    return os.path.splitext(output_file)[0] + ".index.json"
+
+
+# Most shards with open files while writing shards (two files each with gzip_output)
+MAX_OPEN_SHARDS = 64
+
+
+# Write VEventData into one calendar file per period (see SHARD_PERIODS), in a single pass.
+# Every shard is streamed into its own AtomicOutput as its VEVENTs come in, so memory use
+# depends on the number of shards, not events. At most MAX_OPEN_SHARDS of them have their
+# files open; the least recently written one is suspended to make room for another, so even
+# month shards over decades stay far below the open file limit. Afterwards an index file lists
+# the shards in order with their file names and VEVENT counts. Shards of periods without events
+# aren't written (and existing files for them are left alone). Returns whether any file changed.
+def write_shards(vevents, output_file, shard_by, serialize, gzip_output=False, digest_file=False, stats=None):
+    period_format = SHARD_PERIODS[shard_by]
+    shards = {}
+    counts = {}
+    # Shards with open files, least recently written first
+    open_shards = OrderedDict()
+    written = 0
+    with ExitStack() as stack:
+        for data in vevents:
+            period = data.dtstart.strftime(period_format)
+            shard = shards.get(period)
+            if period not in open_shards:
+                if len(open_shards) >= MAX_OPEN_SHARDS:
+                    open_shards.popitem(last=False)[1].suspend()
+                if shard is None:
+                    shard = AtomicOutput(shard_path(output_file, period), gzip_output, digest_file)
+                    shards[period] = stack.enter_context(shard)
+                    counts[period] = 0
+                    shard.write(CALENDAR_HEADER)
+                else:
+                    shard.resume()
+            open_shards[period] = shard
+            open_shards.move_to_end(period)
+            with stage(stats, "serialize"):
+                chunk = serialize(data)
+            with stage(stats, "write"):
+                shard.write(chunk)
+            counts[period] += 1
+            written += len(chunk)
+        with stage(stats, "write"):
+            for period, shard in shards.items():
+                if period in open_shards:
+                    shard.write(CALENDAR_FOOTER)
                 else:
-                    ical_event.add("dtstart", event_date)
-                    ical_event.add("dtend", event_date + timedelta(days=1))  # All-day event ends next day
+                    shard.resume()
+                    shard.write(CALENDAR_FOOTER)
+                    shard.suspend()
+    if stats is not None:
+        stats.count("shards", len(shards))
+        stats.count("bytes_written", written + len(shards) * len(CALENDAR_HEADER + CALENDAR_FOOTER))
 
-                cal.add_component(ical_event)
+    index = {
+        "period": shard_by,
+        "events": sum(counts.values()),
+        "shards": [{"period": period, "file": os.path.basename(shards[period].path), "events": counts[period]}
+                   for period in sorted(shards)],
+    }
+    with AtomicOutput(shard_index_path(output_file)) as index_file:
+        index_file.write(json.dumps(index, indent=2).encode("utf-8") + b"\n")
+    return index_file.changed or any(shard.changed for shard in shards.values())
 
-    with open(output_file, 'wb') as f:
-        f.write(cal.to_ical())
 
+# Occurrence queries: the concrete occurrences of the events in a date window, without writing
+# a calendar. They follow what a calendar client shows for the generated .ics: exception days
+# drop single-day and per-date events and recurrence instances, and a multi-day event is a
+# single occurrence, dropped only if it starts on an exception day (its EXDATEs can only ever
+# hit its DTSTART). start/end are dates for all-day occurrences, with end exclusive like DTEND,
+# and datetimes for timed ones.
+Occurrence = namedtuple("Occurrence", ["start", "end", "summary", "description", "uid"])
 
-# Main function to handle arguments and file processing
-def main():
-    # Argument parsing
-    parser = argparse.ArgumentParser(description="Generate an .ics file from an events array.")
-    parser.add_argument("input_file", help="Path to the Python file containing the events array.")
-    parser.add_argument("output_file", help="Desired output .ics file name.")
 
-    args = parser.parse_args()
-    file_content_parsed = {}
+# Sort key putting occurrences in chronological order, all-day ones first on their day
+def occurrence_key(occurrence):
+    start = occurrence.start
+    if isinstance(start, datetime):
+        return start.toordinal(), start.hour * 3600 + start.minute * 60 + start.second
+    return start.toordinal(), -1
+
+
+# Ordinal of the last day an occurrence from start to end covers
+def last_day_ordinal(start, end):
+    if isinstance(start, datetime):
+        return max(start, end - timedelta(microseconds=1)).toordinal()
+    return max(start, end - timedelta(days=1)).toordinal()
+
+
+# Start of every instance of a recurring VEVENT that starts on or after day `first`, lazily
+# and in order. DAILY and WEEKLY rules jump straight to the first instance in range, and so do
+# MONTHLY and YEARLY rules without COUNT (with COUNT, the earlier instances have to be counted).
+# Finer frequencies are expanded with dateutil from the rule's start.
+def recurrence_starts(data, first):
+    freq = data.rrule["FREQ"].upper()
+    interval = data.rrule.get("INTERVAL", 1)
+    count = data.rrule.get("COUNT")
+    until = data.rrule.get("UNTIL")
+    start = data.dtstart
+    if freq in ("DAILY", "WEEKLY"):
+        step = interval * (7 if freq == "WEEKLY" else 1)
+        # Number of steps before the first instance on or after `first`, rounded up
+        i = max(0, -((start.toordinal() - first.toordinal()) // step))
+        while count is None or i < count:
+            instance = start + timedelta(days=i * step)
+            if until is not None and instance.toordinal() > until.toordinal():
+                return
+            yield instance
+            i += 1
+        return
+
+    first_ordinal = first.toordinal()
+    if freq in ("MONTHLY", "YEARLY"):
+        months = interval * (12 if freq == "YEARLY" else 1)
+        instances = monthly_starts(start, months, first if count is None else None)
+        for instance in islice(instances, count):
+            if until is not None and instance.toordinal() > until.toordinal():
+                return
+            if instance.toordinal() >= first_ordinal:
+                yield instance
+        return
+
+    from dateutil import rrule as dateutil_rrule
+    timed = isinstance(start, datetime)
+    instances = dateutil_rrule.rrule(
+        getattr(dateutil_rrule, freq),
+        dtstart=start if timed else datetime.combine(start, time.min),
+        interval=interval,
+        count=count,
+        until=datetime.combine(until, time.max) if until is not None else None,
+    )
+    for instance in instances:
+        if instance.toordinal() >= first_ordinal:
+            yield instance if timed else instance.date()
+
+
+# Instances of a rule repeating every `months` months on the start's day of the month (a
+# YEARLY rule repeats every 12 * INTERVAL months), skipping months without that day, as
+# dateutil does for rules without BYMONTHDAY. Given `first`, it starts with the first
+# candidate month on or after first's month instead of the start's.
+def monthly_starts(start, months, first=None):
+    start_month = start.year * 12 + start.month - 1
+    i = 0
+    if first is not None:
+        i = max(0, -((start_month - (first.year * 12 + first.month - 1)) // months))
+    while True:
+        year, month = divmod(start_month + i * months, 12)
+        if year > date.max.year:
+            return
+        try:
+            yield start.replace(year=year, month=month + 1)
+        except ValueError:
+            pass
+        i += 1
+
+
+# Ordinal of the day the last instance of a recurring VEVENT starts on, or of its UNTIL day if
+# that comes first (the last instance may be earlier), or None for an open-ended rule.
+# COUNT rules other than DAILY and WEEKLY are expanded to find it.
+def recurrence_last_start(data):
+    count = data.rrule.get("COUNT")
+    until = data.rrule.get("UNTIL")
+    last = None
+    if count is not None:
+        freq = data.rrule["FREQ"].upper()
+        if freq in ("DAILY", "WEEKLY"):
+            step = data.rrule.get("INTERVAL", 1) * (7 if freq == "WEEKLY" else 1)
+            last = data.dtstart.toordinal() + (count - 1) * step
+        else:
+            instances = deque(recurrence_starts(data, data.dtstart), maxlen=1)
+            last = instances[0].toordinal() if instances else data.dtstart.toordinal() - 1
+    if until is not None:
+        last = until.toordinal() if last is None else min(last, until.toordinal())
+    return last
+
+
+# Index of the occurrences of an events array, built once and queried by date window.
+# Events are normalized through the same code that writes calendars, so occurrences match the
+# .ics output. Non-recurring occurrences sit in a list sorted by start, which a window query
+# bisects into. Recurrences are kept as rules, both sorted by start and by the last day they
+# cover (open-ended rules last forever): a query bisects both lists and looks only at the
+# smaller set of candidates, the rules started by the window's end or the ones still running at
+# its start, and expands the rules in both lazily and only within the window. So rules that
+# ended long before the window cost nothing, and neither do rules starting after it.
+class OccurrenceIndex:
+    def __init__(self, events, exceptions=[]):
+        self.exception_dates = ExceptionIndex.from_exceptions(exceptions)
+        occurrences = []
+        rules = []
+        for data in iter_vevent_data(events, self.exception_dates):
+            occurrence = Occurrence(data.dtstart, data.dtend, data.summary, data.description, data.uid)
+            if data.rrule:
+                rule = self.rule(data)
+                if rule is not None:
+                    rules.append(rule)
+            elif data.dtstart not in self.exception_dates:
+                occurrences.append(occurrence)
+        occurrences.sort(key=occurrence_key)
+        self.occurrences = occurrences
+        self.starts = [occurrence.start.toordinal() for occurrence in occurrences]
+        self.last_days = [last_day_ordinal(occurrence.start, occurrence.end) for occurrence in occurrences]
+        # Longest span (in days) of any occurrence, which bounds how far before a window a
+        # still overlapping occurrence can start
+        self.span = max((last - first for first, last in zip(self.starts, self.last_days)), default=0)
+        # Rules as (first day, last day, position by start, VEventData)
+        rules.sort(key=lambda rule: rule[0])
+        self.rules = [(first, last, i, data) for i, (first, last, data) in enumerate(rules)]
+        self.rule_starts = [rule[0] for rule in self.rules]
+        self.rules_by_end = sorted(self.rules, key=lambda rule: rule[1])
+        self.rule_ends = [rule[1] for rule in self.rules_by_end]
+
+    # (first day, last day covered, VEventData) of a recurring VEVENT, or None if it has no
+    # instances. COUNT is turned into the equivalent UNTIL, so that later queries can jump
+    # straight into the window for every frequency recurrence_starts handles arithmetically.
+    @staticmethod
+    def rule(data):
+        first = data.dtstart.toordinal()
+        last = recurrence_last_start(data)
+        if last is None:
+            return first, date.max.toordinal(), data
+        if last < first:
+            return None
+        if "COUNT" in data.rrule:
+            rrule = {part: value for part, value in data.rrule.items() if part != "COUNT"}
+            rrule["UNTIL"] = date.fromordinal(last)
+            data = data._replace(rrule=rrule)
+        return first, last + last_day_ordinal(data.dtstart, data.dtend) - first, data
+
+    # Occurrences overlapping the days first to last (inclusive), in chronological order
+    def between(self, first, last):
+        first_ordinal = first.toordinal()
+        last_ordinal = last.toordinal()
+        streams = [self.single_between(first_ordinal, last_ordinal)]
+        for data in self.rules_between(first_ordinal, last_ordinal):
+            streams.append(self.recurrence_between(data, first_ordinal, last_ordinal))
+        return heapq.merge(*streams, key=occurrence_key)
+
+    # Rules covering any day from first to last, in order of their start
+    def rules_between(self, first_ordinal, last_ordinal):
+        started = bisect_right(self.rule_starts, last_ordinal)
+        running = bisect_left(self.rule_ends, first_ordinal)
+        if started <= len(self.rules_by_end) - running:
+            rules = [rule for rule in self.rules[:started] if rule[1] >= first_ordinal]
+        else:
+            rules = sorted((rule for rule in self.rules_by_end[running:] if rule[0] <= last_ordinal),
+                           key=lambda rule: rule[2])
+        return [rule[3] for rule in rules]
+
+    # Occurrences on one day
+    def on(self, day):
+        return self.between(day, day)
+
+    # Pairs of occurrences overlapping each other within the days first to last (inclusive),
+    # see find_conflicts. With all_day=False, only timed occurrences are compared.
+    def conflicts(self, first, last, all_day=True):
+        window_start = datetime.combine(first, time.min)
+        for conflict in find_conflicts(self.between(first, last), all_day):
+            # Occurrences running into the window from before it may only overlap before it
+            if conflict.end > window_start:
+                yield conflict
+
+    def single_between(self, first_ordinal, last_ordinal):
+        lo = bisect_left(self.starts, first_ordinal - self.span)
+        hi = bisect_right(self.starts, last_ordinal)
+        for i in range(lo, hi):
+            if self.last_days[i] >= first_ordinal:
+                yield self.occurrences[i]
+
+    def recurrence_between(self, data, first_ordinal, last_ordinal):
+        duration = data.dtend - data.dtstart
+        span = last_day_ordinal(data.dtstart, data.dtend) - data.dtstart.toordinal()
+        for start in recurrence_starts(data, date.fromordinal(first_ordinal - span)):
+            if start.toordinal() > last_ordinal:
+                return
+            if start in self.exception_dates:
+                continue
+            end = start + duration
+            if last_day_ordinal(start, end) >= first_ordinal:
+                yield Occurrence(start, end, data.summary, data.description, data.uid)
+
+
+# Occurrences of the events overlapping the days first to last (inclusive). Build an
+# OccurrenceIndex instead to run several queries against the same events.
+def occurrences_between(events, first, last, exceptions=[]):
+    return OccurrenceIndex(events, exceptions).between(first, last)
+
+
+# Conflicts: two occurrences overlapping in time. start/end are the overlap, as datetimes, and
+# first/second the occurrences, in chronological order. All-day occurrences cover their days from
+# midnight to midnight, so they conflict with each other and with timed occurrences on those days.
+# Occurrences that merely touch (one ends when the other starts) don't conflict.
+Conflict = namedtuple("Conflict", ["start", "end", "first", "second"])
+
+
+# Start and (exclusive) end of an occurrence as datetimes
+def occurrence_interval(occurrence):
+    if isinstance(occurrence.start, datetime):
+        return occurrence.start, occurrence.end
+    return datetime.combine(occurrence.start, time.min), datetime.combine(occurrence.end, time.min)
+
+
+# Conflicting pairs among occurrences given in chronological order (as OccurrenceIndex.between
+# yields them), lazily. A sweep line: the occurrences still running are kept in a heap by end
+# time, and each new occurrence first drops the ones that ended before it starts, then conflicts
+# with every one that's left. That is O(n log n) plus the conflicts found, instead of comparing
+# every pair, and only the running occurrences are ever held in memory.
+# With all_day=False, all-day occurrences are left out.
+def find_conflicts(occurrences, all_day=True):
+    running = []
+    for i, occurrence in enumerate(occurrences):
+        if not all_day and not isinstance(occurrence.start, datetime):
+            continue
+        start, end = occurrence_interval(occurrence)
+        while running and running[0][0] <= start:
+            heapq.heappop(running)
+        # In the order they started in (i), not heap order
+        for other_end, _, other in sorted(running, key=lambda item: item[1]):
+            yield Conflict(start, min(end, other_end), other, occurrence)
+        if end > start:
+            heapq.heappush(running, (end, i, occurrence))
+
+
+# Input loaders. Each one returns (events, exceptions) without executing anything from the file.
+
+# Load the Python input format: a file assigning literal "events" and optional "exceptions"
+# arrays, or a file that is just a naked events array. Values are read with ast.literal_eval.
+def load_python(path):
+    with open(path, "r", encoding="utf-8") as f:
+        source = f.read()
+    try:
+        tree = ast.parse(source, filename=path)
+    except SyntaxError as e:
+        raise ValueError(f"{path}, line {e.lineno}: {e.msg}") from None
+    arrays = {}
+    for node in tree.body:
+        if (isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name)
+                and node.targets[0].id in ("events", "exceptions")):
+            name = node.targets[0].id
+        elif isinstance(node, ast.Expr) and len(tree.body) == 1:
+            # A naked array. Exceptions cannot be defined in this case.
+            name = "events"
+        else:
+            raise ValueError(f"{path}, line {node.lineno}: only literal 'events' and 'exceptions' assignments are supported")
+        try:
+            arrays[name] = ast.literal_eval(node.value)
+        except ValueError:
+            raise ValueError(f"{path}, line {node.lineno}: '{name}' must be a literal array") from None
+    if "events" not in arrays:
+        raise ValueError(f"{path}: no 'events' array found")
+    return arrays["events"], arrays.get("exceptions", [])
+
+
+# Load a JSON file: either {"events": [...], "exceptions": [...]} or a naked events array
+def load_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json_input(json.load(f), path)
+
+
+# (events, exceptions) of parsed JSON input; source names it in error messages
+def json_input(content, source):
+    if isinstance(content, list):
+        return content, []
+    if isinstance(content, dict) and "events" in content:
+        return content["events"], content.get("exceptions", [])
+    raise ValueError(f"{source}: expected an events array or an object with an 'events' key")
+
+
+# Columns of the CSV format that are copied into the event as they are
+CSV_EVENT_COLUMNS = ("summary", "description", "date", "date_start", "date_end", "start_time", "end_time")
+# Columns that make up the "recurrence" object, with their types
+CSV_RECURRENCE_COLUMNS = {"freq": str, "interval": int, "count": int, "until": str}
+
+
+# Turn one row of the CSV/NDJSON formats into ("event" | "exception", dict)
+def split_kind(row, path, line):
+    kind = row.pop("kind", None) or "event"
+    if kind not in ("event", "exception"):
+        raise ValueError(f"{path}, line {line}: unknown kind {kind!r}, expected 'event' or 'exception'")
+    return kind, row
+
+
+# Load a CSV file with a header row. Every row is an event unless its "kind" column says
+# "exception". A "dates" cell holds several dates separated by spaces or semicolons, and the
+# freq/interval/count/until columns form the recurrence. Empty cells are ignored.
+def load_csv(path):
     events = []
     exceptions = []
-    # Load the arrays from the input file
-    if os.path.exists(args.input_file):
-        with open(args.input_file, "r") as f:
-            file_content = f.read()
-            # Parsed contents of the events file. This could be a naked array or a dict with keys for "events" and optionally, exceptions
-            exec(file_content, {}, file_content_parsed)
-            # Extract from keys if it's a dict
-            if "events" in file_content_parsed:
-                events = file_content_parsed["events"]
-                # Exceptions array is optional
-                if "exceptions" in file_content_parsed:
-                    exceptions = file_content_parsed["exceptions"]
-            # Otherwise, assume it's a naked array
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            row = {key: value.strip() for key, value in row.items() if key and value and value.strip()}
+            kind, row = split_kind(row, path, reader.line_num)
+            if kind == "exception":
+                exceptions.append(row)
+                continue
+            event = {key: row[key] for key in CSV_EVENT_COLUMNS if key in row}
+            if "dates" in row:
+                event["dates"] = re.split(r"[\s;]+", row["dates"])
+            if "freq" in row:
+                try:
+                    event["recurrence"] = {key: convert(row[key])
+                                           for key, convert in CSV_RECURRENCE_COLUMNS.items() if key in row}
+                except ValueError:
+                    raise ValueError(f"{path}, line {reader.line_num}: interval and count must be whole numbers") from None
+                event["recurrence"].setdefault("interval", 1)
+            events.append(event)
+    return events, exceptions
+
+
+# Load a line-delimited JSON file with one event object per line. Lines with "kind": "exception"
+# are exceptions and have to come before the first event, because exceptions are indexed before
+# any event is processed. The events are returned as a generator that reads the file lazily,
+# so huge event dumps are never held in memory as a whole.
+def load_ndjson(path):
+    f = open(path, "r", encoding="utf-8")
+    exceptions = []
+    first_event = None
+    line_number = 0
+    try:
+        for line in f:
+            line_number += 1
+            if not line.strip():
+                continue
+            kind, row = split_kind(parse_json_line(line, path, line_number), path, line_number)
+            if kind == "event":
+                first_event = row
+                break
+            exceptions.append(row)
+    except BaseException:
+        # The events generator never gets to close it
+        f.close()
+        raise
+
+    def events():
+        with f:
+            if first_event is None:
+                return
+            yield first_event
+            for number, line in enumerate(f, line_number + 1):
+                if not line.strip():
+                    continue
+                kind, row = split_kind(parse_json_line(line, path, number), path, number)
+                if kind == "exception":
+                    raise ValueError(f"{path}, line {number}: exceptions must come before the first event")
+                yield row
+
+    return events(), exceptions
+
+
+def parse_json_line(line, path, line_number):
+    try:
+        row = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"{path}, line {line_number}: {e}") from None
+    if not isinstance(row, dict):
+        raise ValueError(f"{path}, line {line_number}: expected a JSON object")
+    return row
+
+
+LOADERS = {
+    "py": load_python,
+    "json": load_json,
+    "csv": load_csv,
+    "ndjson": load_ndjson,
+}
+# Input format by file extension. Anything else is read as Python.
+FORMAT_EXTENSIONS = {
+    ".json": "json",
+    ".csv": "csv",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+}
+
+
+# Load (events, exceptions) from an input file, picking the loader by file extension
+# unless input_format names one explicitly
+def load_input(path, input_format=None):
+    if input_format is None:
+        input_format = FORMAT_EXTENSIONS.get(os.path.splitext(path)[1].lower(), "py")
+    if input_format not in LOADERS:
+        raise ValueError(f"Unknown input format {input_format!r}, expected one of: {', '.join(LOADERS)}")
+    return LOADERS[input_format](path)
+
+
+# Counts of a merge of several inputs. Events are merged lazily, so the event counts are
+# only final once the merged events have been consumed.
+class MergeReport:
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.events = 0
+        self.duplicate_events = 0
+        self.exceptions = 0
+        self.duplicate_exceptions = 0
+
+    def __str__(self):
+        return (f"Merged {self.inputs} input files: {self.events} events "
+                f"({self.duplicate_events} duplicates dropped), {self.exceptions} exceptions "
+                f"({self.duplicate_exceptions} duplicates dropped)")
+
+
+# Merge several (events, exceptions) inputs into one, in a single pass over each.
+# Events with the same content (event_content, which their UIDs are derived from as well) are
+# kept once, at their first appearance; a set of content hashes makes that one lookup per
+# event. Exceptions covering the same date range are kept once too; overlapping ranges are
+# merged later by the ExceptionIndex anyway. Exceptions are merged up front, as create_ics
+# needs them before the first event, while events are merged lazily as they are consumed.
+# Returns (events, exceptions, report).
+def merge_inputs(inputs):
+    report = MergeReport(len(inputs))
+    exceptions = []
+    seen_ranges = set()
+    for _, input_exceptions in inputs:
+        for exception in input_exceptions:
+            key = (parse_date(exception["date_start"]), parse_date(exception["date_end"]))
+            if key in seen_ranges:
+                report.duplicate_exceptions += 1
+                continue
+            seen_ranges.add(key)
+            exceptions.append(exception)
+    report.exceptions = len(exceptions)
+
+    def events():
+        seen = set()
+        for input_events, _ in inputs:
+            for event in input_events:
+                digest = hashlib.sha256(event_content(event).encode("utf-8")).digest()
+                if digest in seen:
+                    report.duplicate_events += 1
+                    continue
+                seen.add(digest)
+                report.events += 1
+                yield event
+
+    return events(), exceptions, report
+
+
+# Input validation for --check. It looks at the loaded events and exceptions the way
+# event_vevent_data would, but without generating anything, so it needs neither icalendar
+# nor dateutil.
+
+# RRULE frequencies (RFC 5545, section 3.3.10)
+RECURRENCE_FREQUENCIES = ("SECONDLY", "MINUTELY", "HOURLY", "DAILY", "WEEKLY", "MONTHLY", "YEARLY")
+
+
+# Parse value with parse_date/parse_time, recording a problem and returning None if it is invalid
+def checked(parse, value, name, problems):
+    try:
+        return parse(value)
+    except ValueError as e:
+        problems.append(f"{name}: {e}")
+        return None
+
+
+# Whether value is a positive integer (and not a bool)
+def is_positive_int(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+# Problems with one recurrence object
+def recurrence_problems(recurrence, event_date):
+    if not isinstance(recurrence, dict):
+        return ["recurrence: expected an object"]
+    problems = []
+    freq = recurrence.get("freq")
+    if not isinstance(freq, str) or freq.upper() not in RECURRENCE_FREQUENCIES:
+        problems.append(f"recurrence.freq: expected one of {', '.join(RECURRENCE_FREQUENCIES)}, got {freq!r}")
+    # interval is optional and defaults to 1 (see recurrence_rrule)
+    if "interval" in recurrence and not is_positive_int(recurrence["interval"]):
+        problems.append(f"recurrence.interval: expected a positive integer, got {recurrence['interval']!r}")
+    if "count" in recurrence and not is_positive_int(recurrence["count"]):
+        problems.append(f"recurrence.count: expected a positive integer, got {recurrence['count']!r}")
+    if "until" in recurrence:
+        until = checked(parse_date, recurrence["until"], "recurrence.until", problems)
+        if until is not None and event_date is not None and until < event_date:
+            problems.append(f"recurrence.until {recurrence['until']} is before date {event_date:%d.%m.%Y}")
+    return problems
+
+
+# Problems with one event
+def event_problems(event):
+    if not isinstance(event, dict):
+        return [f"expected an object, got {type(event).__name__}"]
+    problems = []
+    if "summary" not in event:
+        problems.append("summary is missing")
+    elif not isinstance(event["summary"], str):
+        problems.append("summary: expected a string")
+
+    shape = event_shape(event)
+    start_date = end_date = None
+    if shape == "dates":
+        if not isinstance(event["dates"], list) or not event["dates"]:
+            problems.append("dates: expected a non-empty list of dates")
+        else:
+            for i, value in enumerate(event["dates"]):
+                checked(parse_date, value, f"dates[{i}]", problems)
+    elif shape == "multi_day":
+        start_date = checked(parse_date, event["date_start"], "date_start", problems)
+        end_date = checked(parse_date, event["date_end"], "date_end", problems)
+        if start_date is not None and end_date is not None and start_date > end_date:
+            problems.append(f"date_start {event['date_start']} is after date_end {event['date_end']}")
+    elif "date" not in event:
+        problems.append("no date: expected date, dates, or date_start and date_end")
+    else:
+        start_date = end_date = checked(parse_date, event["date"], "date", problems)
+
+    if ("start_time" in event) != ("end_time" in event):
+        problems.append("start_time and end_time have to be given together")
+    elif "start_time" in event:
+        start_time = checked(parse_time, event["start_time"], "start_time", problems)
+        end_time = checked(parse_time, event["end_time"], "end_time", problems)
+        # Only a multi-day event may end at an earlier time of day than it starts
+        same_day = shape != "multi_day" or (start_date is not None and start_date == end_date)
+        if start_time is not None and end_time is not None and same_day and start_time > end_time:
+            problems.append(f"start_time {event['start_time']} is after end_time {event['end_time']}")
+
+    if shape == "recurrence":
+        problems.extend(recurrence_problems(event["recurrence"], start_date))
+    return problems
+
+
+# Problems with one exception
+def exception_problems(exception):
+    if not isinstance(exception, dict):
+        return [f"expected an object, got {type(exception).__name__}"]
+    problems = []
+    bounds = []
+    for key in ("date_start", "date_end"):
+        if key not in exception:
+            problems.append(f"{key} is missing")
+            bounds.append(None)
+        else:
+            bounds.append(checked(parse_date, exception[key], key, problems))
+    if None not in bounds and bounds[0] > bounds[1]:
+        problems.append(f"date_start {exception['date_start']} is after date_end {exception['date_end']}")
+    return problems
+
+
+# Validate loaded input. Returns every problem found as "event 3 (Summary): message" or
+# "exception 1: message"; an empty list means the input can be converted.
+def check_input(events, exceptions):
+    problems = []
+    for i, exception in enumerate(exceptions, 1):
+        problems.extend(f"exception {i}: {problem}" for problem in exception_problems(exception))
+    for i, event in enumerate(events, 1):
+        label = f"event {i}"
+        if isinstance(event, dict) and isinstance(event.get("summary"), str):
+            label += f" ({event['summary']})"
+        problems.extend(f"{label}: {problem}" for problem in event_problems(event))
+    return problems
+
+
+# Options shared by every command that writes calendars
+def add_calendar_arguments(parser):
+    parser.add_argument("--format", choices=sorted(LOADERS),
+                        help="Input file format. By default it is picked by file extension, falling back to Python.")
+    parser.add_argument("--prune-exdates", action="store_true",
+                        help="Only add EXDATEs to recurring events for exceptions that hit an occurrence.")
+    parser.add_argument("--stream", action="store_true",
+                        help="Write events to the output file as they are generated instead of building the calendar in memory.")
+    parser.add_argument("--compact-dates", action="store_true",
+                        help="Write events with a 'dates' list as a single VEVENT with RDATEs instead of one VEVENT per date.")
+    parser.add_argument("--serializer", choices=["icalendar", "native"], default="icalendar",
+                        help="How events are serialized. 'native' skips icalendar's property objects and is much faster.")
+    parser.add_argument("--parallel", type=int, default=1, metavar="N",
+                        help="Serialize events in N worker processes (default: 1, no worker processes).")
+    parser.add_argument("--cache-dir", default=default_cache_dir(),
+                        help="Where serialized events are cached between runs (default: %(default)s).")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Serialize every event from scratch and leave the cache alone.")
+    parser.add_argument("--gzip", action="store_true",
+                        help="Also write a gzip-compressed copy of the output next to it, as <output>.gz.")
+    parser.add_argument("--digest", action="store_true",
+                        help="Also write the SHA-256 of the output next to it, as <output>.sha256.")
+    parser.add_argument("--shard-by", choices=sorted(SHARD_PERIODS),
+                        help="Split the calendar into one file per year or month (<output>-2024.ics, ...), "
+                             "listed in <output>.index.json.")
+
+
+# create_ics keyword arguments for the parsed calendar options
+def calendar_options(args):
+    return {
+        "prune_exdates": args.prune_exdates,
+        "streaming": args.stream,
+        "serializer": args.serializer,
+        "compact_dates": args.compact_dates,
+        "workers": args.parallel,
+        "gzip_output": args.gzip,
+        "digest_file": args.digest,
+        "shard_by": args.shard_by,
+    }
+
+
+# Cache directory for the parsed options, or None with --no-cache (or --shard-by, which doesn't use it)
+def calendar_cache_dir(args):
+    return None if args.no_cache or args.shard_by else args.cache_dir
+
+
+# Load one input file and write its calendar. Used for every file of a batch, possibly in a
+# worker process, so failures are returned as an error message instead of raised.
+def convert_file(input_file, output_file, input_format=None, options={}, cache_dir=None):
+    try:
+        events, exceptions = load_input(input_file, input_format)
+        cache = VEventCache(cache_path(cache_dir, output_file)) if cache_dir else None
+        create_ics(events, output_file, exceptions, cache=cache, **options)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+# Input file extensions picked up when a batch source is a directory
+BATCH_EXTENSIONS = {".py", ".json", ".csv", ".ndjson", ".jsonl"}
+
+
+# Input → output pairs of a batch. The source is either a directory, whose input files
+# (by extension) are converted into <output_dir>/<name>.ics, or a JSON manifest mapping
+# input files to output files, as an object or a list of [input, output] pairs.
+# Relative paths in a manifest are relative to the manifest itself; with output_dir, outputs go there.
+def batch_jobs(source, output_dir=None):
+    if os.path.isdir(source):
+        output_dir = output_dir or source
+        jobs = []
+        for name in sorted(os.listdir(source)):
+            stem, extension = os.path.splitext(name)
+            if extension.lower() in BATCH_EXTENSIONS and os.path.isfile(os.path.join(source, name)):
+                jobs.append((os.path.join(source, name), os.path.join(output_dir, stem + ".ics")))
+        return jobs
+
+    with open(source, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    pairs = manifest.items() if isinstance(manifest, dict) else manifest
+    base_dir = os.path.dirname(os.path.abspath(source))
+    jobs = []
+    for pair in pairs:
+        if len(pair) != 2:
+            raise ValueError(f"{source}: manifest entries must be [input, output] pairs")
+        input_file, output_file = pair
+        output_file = os.path.join(output_dir or base_dir, output_file)
+        jobs.append((os.path.join(base_dir, input_file), output_file))
+    return jobs
+
+
+# Convert every input → output pair in one process, or fanned out over a process pool when
+# workers > 1. Returns a list of (input_file, output_file, error) in job order; error is None
+# on success.
+def run_batch(jobs, workers=1, input_format=None, options={}, cache_dir=None):
+    if workers > 1 and len(jobs) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(convert_file, input_file, output_file, input_format, options, cache_dir)
+                       for input_file, output_file in jobs]
+            errors = [future.result() for future in futures]
+    else:
+        errors = [convert_file(input_file, output_file, input_format, options, cache_dir)
+                  for input_file, output_file in jobs]
+    return [(input_file, output_file, error) for (input_file, output_file), error in zip(jobs, errors)]
+
+
+# Entry point of the "batch" command
+def batch_main(argv):
+    parser = argparse.ArgumentParser(prog="generate_ics.py batch",
+                                     description="Generate many .ics files in one process.")
+    parser.add_argument("source", help="Directory of input files, or a JSON manifest of input → output files.")
+    parser.add_argument("-o", "--output-dir",
+                        help="Directory for the .ics files (default: next to the inputs or manifest entries).")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="Number of worker processes (default: 1, everything in this process).")
+    add_calendar_arguments(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        jobs = batch_jobs(args.source, args.output_dir)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return 1
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    results = run_batch(jobs, args.workers, args.format, calendar_options(args), calendar_cache_dir(args))
+    failed = 0
+    for input_file, output_file, error in results:
+        if error is None:
+            print(f"ok      {input_file} -> {output_file}")
+        else:
+            failed += 1
+            print(f"FAILED  {input_file}: {error}")
+    print(f"{len(results) - failed} succeeded, {failed} failed")
+    return 1 if failed else 0
+
+
+# The "serve" command: a long-running local HTTP service rendering calendars on request.
+#   POST /calendar          body: JSON input, as in a .json input file
+#   GET  /calendars/NAME.ics    a registered input file (serve --register NAME=PATH)
+# Rendered calendars are kept in an LRU cache keyed by a hash of the input and the options,
+# and the same hash is the response's ETag: a poll with a matching If-None-Match gets a 304
+# without the calendar being rendered, or even looked up, again.
+
+# Largest request body the server accepts
+MAX_PAYLOAD_BYTES = 50 * 1024 * 1024
+
+
+# Render a calendar into bytes instead of a file. Takes the create_ics options.
+def render_ics(events, exceptions=[], **options):
+    buffer = io.BytesIO()
+    create_ics(events, buffer, exceptions, **options)
+    return buffer.getvalue()
+
+
+# Request handling of the serve command, independent of the HTTP server, so it can be used
+# (and tested) without sockets. handle() returns (status, headers, body).
+class CalendarService:
+    def __init__(self, registered={}, input_format=None, options={}, cache_size=64):
+        self.registered = dict(registered)
+        self.input_format = input_format
+        self.options = dict(options)
+        self.cache_size = cache_size
+        self.rendered = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Cache key of an input: its raw bytes plus everything else that shapes the output
+    def key(self, content):
+        options = json.dumps([__version__, self.options], sort_keys=True).encode("utf-8")
+        return hashlib.sha256(options + b"\n" + content).hexdigest()
+
+    # Rendered calendar for key, from the cache or by loading and rendering the input
+    def render(self, key, load):
+        with self.lock:
+            content = self.rendered.get(key)
+            if content is not None:
+                self.rendered.move_to_end(key)
+                self.hits += 1
+                return content
+            self.misses += 1
+        events, exceptions = load()
+        events = list(events)
+        problems = check_input(events, exceptions)
+        if problems:
+            raise ValueError("\n".join(problems))
+        content = render_ics(events, exceptions, **self.options)
+        with self.lock:
+            self.rendered[key] = content
+            while len(self.rendered) > self.cache_size:
+                self.rendered.popitem(last=False)
+        return content
+
+    def handle(self, method, path, headers, body=b""):
+        path = path.split("?", 1)[0]
+        try:
+            if method == "POST" and path == "/calendar":
+                if len(body) > MAX_PAYLOAD_BYTES:
+                    return self.error(413, "Payload too large")
+                key = self.key(body)
+                load = lambda: json_input(json.loads(body), "payload")
+            elif method == "GET" and path.startswith("/calendars/") and path.endswith(".ics"):
+                name = path[len("/calendars/"):-len(".ics")]
+                if name not in self.registered:
+                    return self.error(404, f"No calendar named {name!r}")
+                input_file = self.registered[name]
+                with open(input_file, "rb") as f:
+                    key = self.key(input_file.encode("utf-8") + b"\n" + f.read())
+                load = lambda: load_input(input_file, self.input_format)
             else:
-                events = eval(file_content)
-                # Exceptions cannot be defined in this case.
+                return self.error(404, f"Not found: {method} {path}")
+
+            etag = f'"{key[:32]}"'
+            if etag_matches(headers.get("If-None-Match"), etag):
+                return 304, {"ETag": etag}, b""
+            content = self.render(key, load)
+        except OSError as e:
+            return self.error(404, str(e))
+        except (TypeError, ValueError) as e:
+            # A broken payload is the client's fault, a broken registered file the server's
+            return self.error(400 if method == "POST" else 500, str(e))
+        return 200, {"Content-Type": "text/calendar; charset=utf-8", "ETag": etag}, content
+
+    @staticmethod
+    def error(status, message):
+        return status, {"Content-Type": "text/plain; charset=utf-8"}, (message + "\n").encode("utf-8")
+
+
+# Whether an If-None-Match header value matches etag (weak comparison, RFC 9110 section 13.1.2)
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+# HTTP server for a CalendarService. http.server is only imported here, since most runs never need it.
+def make_server(service, host="127.0.0.1", port=8000, quiet=False):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class CalendarRequestHandler(BaseHTTPRequestHandler):
+        server_version = f"ical-creator/{__version__}"
+
+        def do_GET(self):
+            self.send(*service.handle("GET", self.path, self.headers))
+
+        # Like GET, without the body
+        def do_HEAD(self):
+            self.send(*service.handle("GET", self.path, self.headers), head=True)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > MAX_PAYLOAD_BYTES:
+                self.send(*service.error(413, "Payload too large"))
+                return
+            self.send(*service.handle("POST", self.path, self.headers, self.rfile.read(length)))
 
+        def send(self, status, headers, content, head=False):
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            if status != 304:
+                self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            if status != 304 and not head:
+                self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            if not quiet:
+                super().log_message(format, *args)
+
+    server = ThreadingHTTPServer((host, port), CalendarRequestHandler)
+    server.daemon_threads = True
+    return server
+
+
+# Parse a --register NAME=PATH value
+def registration(value):
+    name, separator, path = value.partition("=")
+    if not separator or not name or "/" in name or not path:
+        raise argparse.ArgumentTypeError(f"expected NAME=PATH, got {value!r}")
+    return name, path
+
+
+# Entry point of the "serve" command
+def serve_main(argv):
+    parser = argparse.ArgumentParser(prog="generate_ics.py serve",
+                                     description="Serve calendars over HTTP, rendered on request and cached.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: %(default)s, local only).")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on (default: %(default)s).")
+    parser.add_argument("--register", type=registration, action="append", default=[], metavar="NAME=PATH",
+                        help="Serve the input file PATH as /calendars/NAME.ics. Can be given several times.")
+    parser.add_argument("--cache-size", type=int, default=64,
+                        help="Number of rendered calendars kept in memory (default: %(default)s).")
+    parser.add_argument("--format", choices=sorted(LOADERS),
+                        help="Format of the registered input files. By default it is picked by file extension.")
+    parser.add_argument("--prune-exdates", action="store_true",
+                        help="Only add EXDATEs to recurring events for exceptions that hit an occurrence.")
+    parser.add_argument("--compact-dates", action="store_true",
+                        help="Write events with a 'dates' list as a single VEVENT with RDATEs.")
+    parser.add_argument("--serializer", choices=["icalendar", "native"], default="icalendar",
+                        help="How events are serialized. 'native' skips icalendar's property objects and is much faster.")
+    parser.add_argument("--quiet", action="store_true", help="Don't log requests.")
+    args = parser.parse_args(argv)
+
+    for name, path in args.register:
+        if not os.path.exists(path):
+            print(f"Error: File {path} not found.")
+            return 1
+    options = {"prune_exdates": args.prune_exdates, "compact_dates": args.compact_dates, "serializer": args.serializer}
+    service = CalendarService(dict(args.register), args.format, options, args.cache_size)
+    server = make_server(service, args.host, args.port, args.quiet)
+    host, port = server.server_address[:2]
+    print(f"Serving calendars on http://{host}:{port}/")
+    for name, path in args.register:
+        print(f"  /calendars/{name}.ics <- {path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+# An occurrence as one line of text: its dates and times, then its summary
+def format_occurrence(occurrence):
+    start, end = occurrence.start, occurrence.end
+    if isinstance(start, datetime):
+        if end.date() == start.date():
+            when = f"{start:%d.%m.%Y %H:%M}-{end:%H:%M}"
+        else:
+            when = f"{start:%d.%m.%Y %H:%M} - {end:%d.%m.%Y %H:%M}"
     else:
-        print(f"Error: File {args.input_file} not found.")
-        return
+        last_day = max(start, end - timedelta(days=1))
+        when = f"{start:%d.%m.%Y}" if last_day == start else f"{start:%d.%m.%Y} - {last_day:%d.%m.%Y}"
+    return f"{when}  {occurrence.summary}"
 
-    # Call the function to create the .ics file
-    create_ics(events, args.output_file, exceptions)
-    print(f".ics file created: {args.output_file}")
 
-if __name__ == "__main__":
-    main()
+# An occurrence as a JSON object
+def occurrence_json(occurrence):
+    return {
+        "start": occurrence.start.isoformat(),
+        "end": occurrence.end.isoformat(),
+        "all_day": not isinstance(occurrence.start, datetime),
+        "summary": occurrence.summary,
+        "description": occurrence.description,
+        "uid": occurrence.uid,
+    }
+
+
+# Columns of the --conflicts --csv output
+CONFLICT_CSV_FIELDS = ["overlap_start", "overlap_end", "first_summary", "first_start", "first_end", "first_uid",
+                       "second_summary", "second_start", "second_end", "second_uid"]
+
+
+# A conflict as a CSV row (see CONFLICT_CSV_FIELDS)
+def conflict_row(conflict):
+    row = [conflict.start.isoformat(), conflict.end.isoformat()]
+    for occurrence in (conflict.first, conflict.second):
+        row += [occurrence.summary, occurrence.start.isoformat(), occurrence.end.isoformat(), occurrence.uid]
+    return row
+
+
+# A conflict as a JSON object
+def conflict_json(conflict):
+    return {
+        "start": conflict.start.isoformat(),
+        "end": conflict.end.isoformat(),
+        "first": occurrence_json(conflict.first),
+        "second": occurrence_json(conflict.second),
+    }
+
+
+# How far ahead --conflicts looks without --to, since open-ended recurrences never stop
+CONFLICTS_HORIZON = timedelta(days=365)
+
+
+# Print the conflicts in a date range as text, CSV or JSON
+def print_conflicts(conflicts, output_format):
+    if output_format == "json":
+        print(json.dumps([conflict_json(conflict) for conflict in conflicts], indent=2, ensure_ascii=False))
+    elif output_format == "csv":
+        writer = csv.writer(sys.stdout, lineterminator="\n")
+        writer.writerow(CONFLICT_CSV_FIELDS)
+        writer.writerows(map(conflict_row, conflicts))
+    else:
+        for conflict in conflicts:
+            print(f"{format_occurrence(conflict.first)}  <->  {format_occurrence(conflict.second)}")
 
+
+# argparse type for DD.MM.YYYY arguments
+def date_argument(value):
+    try:
+        return parse_date(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+# Entry point of the "query" command
+def query_main(argv):
+    parser = argparse.ArgumentParser(prog="generate_ics.py query",
+                                     description="Print the occurrences of the events in a date range.")
+    parser.add_argument("input_files", nargs="+", metavar="input_file",
+                        help="Input file(s) containing the events array. Several input files are merged.")
+    parser.add_argument("--from", dest="first", type=date_argument, default=date.today(), metavar="DD.MM.YYYY",
+                        help="First day of the range (default: today).")
+    parser.add_argument("--to", dest="last", type=date_argument, metavar="DD.MM.YYYY",
+                        help="Last day of the range, inclusive (default: the first day, or a year later with --conflicts).")
+    parser.add_argument("--format", choices=sorted(LOADERS),
+                        help="Input file format. By default it is picked by file extension, falling back to Python.")
+    parser.add_argument("--conflicts", action="store_true",
+                        help="Print the pairs of occurrences that overlap in time instead of the occurrences.")
+    parser.add_argument("--timed-only", action="store_true",
+                        help="With --conflicts, ignore all-day occurrences.")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--json", action="store_true", help="Print the occurrences or conflicts as a JSON array.")
+    output.add_argument("--csv", action="store_true", help="Print the conflicts as CSV (with --conflicts).")
+    args = parser.parse_args(argv)
+    if args.csv and not args.conflicts:
+        parser.error("--csv only works with --conflicts")
+    last = args.last or (args.first + CONFLICTS_HORIZON if args.conflicts else args.first)
+    if last < args.first:
+        parser.error("--to is before --from")
+
+    try:
+        inputs = [load_input(input_file, args.format) for input_file in args.input_files]
+        if len(inputs) > 1:
+            events, exceptions, _ = merge_inputs(inputs)
+        else:
+            events, exceptions = inputs[0]
+        index = OccurrenceIndex(events, exceptions)
+        if args.conflicts:
+            conflicts = index.conflicts(args.first, last, all_day=not args.timed_only)
+            print_conflicts(conflicts, "json" if args.json else "csv" if args.csv else "text")
+            return 0
+        occurrences = index.between(args.first, last)
+        if args.json:
+            print(json.dumps([occurrence_json(occurrence) for occurrence in occurrences], indent=2, ensure_ascii=False))
+        else:
+            for occurrence in occurrences:
+                print(format_occurrence(occurrence))
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+
+# --check: validate an input file, print its problems and return 1 if there are any
+def check_main(input_file, input_format=None):
+    try:
+        events, exceptions = load_input(input_file, input_format)
+        problems = check_input(events, exceptions)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return 1
+    for problem in problems:
+        print(problem)
+    if problems:
+        print(f"{input_file}: {len(problems)} problem{'s' if len(problems) != 1 else ''} found")
+        return 1
+    print(f"{input_file}: OK")
+    return 0
+
+
+# Commands besides the default "input_file output_file" conversion
+COMMANDS = {
+    "batch": batch_main,
+    "query": query_main,
+    "serve": serve_main,
+}
+
+
+# Main function to handle arguments and file processing
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:
+        return COMMANDS[argv[0]](argv[1:])
+
+    # Argument parsing
+    parser = argparse.ArgumentParser(description="Generate an .ics file from an events array.",
+                                     epilog="Other commands: 'batch' converts many files at once, 'query' prints what is on "
+                                            "in a date range, 'serve' serves calendars over HTTP. Run "
+                                            "'generate_ics.py COMMAND --help' for their options.")
+    parser.add_argument("files", nargs="+", metavar="FILE",
+                        help="Input file(s) containing the events array (Python, JSON, CSV or NDJSON), followed by "
+                             "the desired output .ics file name. Several input files are merged into one calendar, "
+                             "dropping duplicate events and exceptions.")
+    parser.add_argument("--check", action="store_true",
+                        help="Only validate the input files and report any problems; no output file is written "
+                             "(an output .ics file name is ignored).")
+    add_calendar_arguments(parser)
+    parser.add_argument("--stats", nargs="?", const="-", metavar="FILE",
+                        help="Report time per stage and event counters; printed, or saved as JSON to FILE.")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="Profile the run with cProfile and save the profile to FILE (read it with pstats or snakeviz).")
+
+    args = parser.parse_args(argv)
+    if args.check:
+        # Only the inputs are checked; an output .ics file given as well is ignored
+        input_files = args.files[:-1] if len(args.files) > 1 and args.files[-1].lower().endswith(".ics") else args.files
+        return max([check_main(input_file, args.format) for input_file in input_files])
+    if len(args.files) < 2:
+        parser.error("the following arguments are required: output_file")
+    *input_files, output_file = args.files
+    for input_file in input_files:
+        if not os.path.exists(input_file):
+            print(f"Error: File {input_file} not found.")
+            return 1
+
+    # Load the arrays from the input files and create the .ics file.
+    # Loaders may be lazy, so input errors can also surface while the calendar is created.
+    cache_dir = calendar_cache_dir(args)
+    cache = VEventCache(cache_path(cache_dir, output_file)) if cache_dir else None
+    stats = Stats() if args.stats else None
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        with stage(stats, "load"):
+            inputs = [load_input(input_file, args.format) for input_file in input_files]
+        merge_report = None
+        if len(inputs) > 1:
+            with stage(stats, "load"):
+                events, exceptions, merge_report = merge_inputs(inputs)
+        else:
+            events, exceptions = inputs[0]
+        changed = create_ics(events, output_file, exceptions, cache=cache, stats=stats, **calendar_options(args))
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+    if args.shard_by:
+        print(f".ics shards {'created' if changed else 'unchanged'}, listed in {shard_index_path(output_file)}")
+    else:
+        print(f".ics file {'created' if changed else 'unchanged'}: {output_file}")
+    if merge_report is not None:
+        print(merge_report)
+    if cache is not None:
+        print(f"Event cache: {cache.stats()}")
+    if profiler is not None:
+        print(f"Profile written to {args.profile}")
+    if stats is not None:
+        if args.stats == "-":
+            print(stats.report())
+        else:
+            with open(args.stats, "w", encoding="utf-8") as f:
+                json.dump(stats.as_dict(), f, indent=2)
+            print(f"Stats written to {args.stats}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
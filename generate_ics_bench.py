@@ -0,0 +1,353 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+from generate_ics import OccurrenceIndex, create_ics, find_conflicts, load_input
+
+
+# Benchmarks for generate_ics.py. Run with e.g.
+#   python3 generate_ics_bench.py serializers --size 20000
+#   python3 generate_ics_bench.py suite --sizes 1000 10000 100000 --output results.json
+#   python3 generate_ics_bench.py suite --compare results.json
+
+
+FIRST_DAY = date(2020, 1, 1)
+
+
+def day_string(offset):
+    return (FIRST_DAY + timedelta(days=offset)).strftime("%d.%m.%Y")
+
+
+# Synthetic workloads, one per branch of create_ics. Each takes a size (the number of events,
+# or of dates for the dates-based workloads) and returns (events, exceptions).
+
+# One event with `size` specific dates, the shape that expands into the most VEVENTs
+def dates_workload(size):
+    dates = [day_string(i) for i in range(size)]
+    events = [{"summary": "Training, Halle 2", "description": "Bring shoes; water", "dates": dates,
+               "start_time": "17:00", "end_time": "18:30"}]
+    return events, []
+
+
+# `size` single-day events with times, the typical shape of a generated events file
+def single_day_workload(size):
+    events = [{"summary": f"Event {i}", "date": day_string(i % 3650), "start_time": "10:00", "end_time": "12:00"}
+              for i in range(size)]
+    exceptions = [{"date_start": "24.12.2020", "date_end": "06.01.2021"}]
+    return events, exceptions
+
+
+# `size` week-long events
+def multi_day_workload(size):
+    events = [{"summary": f"Camp {i}", "date_start": day_string(i % 3650), "date_end": day_string(i % 3650 + 6)}
+              for i in range(size)]
+    exceptions = [{"date_start": day_string(offset), "date_end": day_string(offset + 13)} for offset in range(0, 3650, 180)]
+    return events, exceptions
+
+
+# `size` recurring events, half bounded by COUNT and half by UNTIL
+def recurrence_workload(size):
+    events = []
+    for i in range(size):
+        recurrence = {"freq": "WEEKLY", "interval": 1 + i % 3}
+        if i % 2:
+            recurrence["count"] = 20
+        else:
+            recurrence["until"] = day_string(i % 3650 + 365)
+        events.append({"summary": f"Lesson {i}", "date": day_string(i % 3650), "start_time": "15:00",
+                       "end_time": "16:00", "recurrence": recurrence})
+    exceptions = [{"date_start": day_string(offset), "date_end": day_string(offset + 13)} for offset in range(0, 3650, 180)]
+    return events, exceptions
+
+
+# Dates events against a long list of overlapping exception ranges (about one per 10 occurrences)
+def exceptions_workload(size):
+    events = [{"summary": f"Practice {i}", "dates": [day_string((i * 7 + j * 3) % 3650) for j in range(10)]}
+              for i in range(max(1, size // 10))]
+    exceptions = [{"date_start": day_string(i * 37 % 3650), "date_end": day_string(i * 37 % 3650 + i % 9)}
+                  for i in range(max(1, size // 10))]
+    return events, exceptions
+
+
+WORKLOADS = {
+    "single_day": single_day_workload,
+    "multi_day": multi_day_workload,
+    "dates": dates_workload,
+    "recurrence": recurrence_workload,
+    "exceptions": exceptions_workload,
+}
+
+
+# Write a workload in each input format, returning {format: path}
+def write_input_files(tmp, events, exceptions):
+    paths = {}
+    paths["py"] = os.path.join(tmp, "events.py")
+    with open(paths["py"], "w", encoding="utf-8") as f:
+        f.write(f"events = {events!r}\nexceptions = {exceptions!r}\n")
+    paths["json"] = os.path.join(tmp, "events.json")
+    with open(paths["json"], "w", encoding="utf-8") as f:
+        json.dump({"events": events, "exceptions": exceptions}, f)
+    paths["ndjson"] = os.path.join(tmp, "events.ndjson")
+    with open(paths["ndjson"], "w", encoding="utf-8") as f:
+        for exception in exceptions:
+            f.write(json.dumps({"kind": "exception", **exception}) + "\n")
+        for event in events:
+            f.write(json.dumps(event) + "\n")
+    paths["csv"] = os.path.join(tmp, "events.csv")
+    with open(paths["csv"], "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, ["kind", "summary", "date", "date_start", "date_end", "start_time", "end_time"])
+        writer.writeheader()
+        for exception in exceptions:
+            writer.writerow({"kind": "exception", **exception})
+        writer.writerows(events)
+    return paths
+
+
+# The loader main() used before the dedicated loaders: exec the file, then look up "events"
+def legacy_exec_load(path):
+    parsed = {}
+    with open(path, "r") as f:
+        exec(f.read(), {}, parsed)
+    return parsed["events"], parsed.get("exceptions", [])
+
+
+# Best wall time out of `repeat` runs of fn()
+def best_time(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+# Peak memory allocated by Python objects while fn() runs
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+# icalendar vs native serializer on the same workload
+def bench_serializers(args):
+    events, exceptions = dates_workload(args.size)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        output_file = os.path.join(tmp, "bench.ics")
+        for serializer in ("icalendar", "native"):
+            results[serializer] = best_time(
+                lambda: create_ics(events, output_file, exceptions, serializer=serializer), args.repeat)
+    for serializer, seconds in results.items():
+        print(f"{serializer:>10}: {seconds:8.3f}s  {args.size / seconds:12.0f} events/s")
+    print(f"{'speedup':>10}: {results['icalendar'] / results['native']:8.1f}x")
+
+
+# Load time of each input format, including fully consuming lazy loaders
+def bench_loaders(args):
+    events, exceptions = single_day_workload(args.size)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_input_files(tmp, events, exceptions)
+
+        def load(loader, path):
+            loaded_events, loaded_exceptions = loader(path)
+            for _ in loaded_events:
+                pass
+
+        results = {"py (exec)": best_time(lambda: load(legacy_exec_load, paths["py"]), args.repeat)}
+        for input_format, path in paths.items():
+            results[input_format] = best_time(lambda: load(lambda p: load_input(p, input_format), path), args.repeat)
+        for input_format, seconds in results.items():
+            size_mb = os.path.getsize(paths[input_format.split()[0]]) / 1e6
+            print(f"{input_format:>10}: {seconds:8.3f}s  {args.size / seconds:12.0f} events/s  ({size_mb:.1f} MB)")
+
+
+# Serial vs parallel create_ics across 1/2/4/8 workers, checking that the output is identical
+def bench_parallel(args):
+    events, exceptions = single_day_workload(args.size)
+    print(f"{os.cpu_count()} CPUs available")
+    with tempfile.TemporaryDirectory() as tmp:
+        outputs = {}
+        baseline = None
+        for workers in (1, 2, 4, 8):
+            output_file = os.path.join(tmp, f"bench-{workers}.ics")
+            seconds = best_time(lambda: create_ics(events, output_file, exceptions, workers=workers), args.repeat)
+            baseline = baseline or seconds
+            with open(output_file, "rb") as f:
+                outputs[workers] = f.read()
+            print(f"{workers:>3} workers: {seconds:8.3f}s  {args.size / seconds:12.0f} events/s  {baseline / seconds:5.2f}x")
+        if any(output != outputs[1] for output in outputs.values()):
+            raise AssertionError("parallel output differs from serial output")
+
+
+# `size` weekly lessons of 12 occurrences each, one starting every day, each 45 minutes long at
+# a pseudo-random time between 8:00 and 18:00. So every day has about 12 lessons, and each one
+# overlaps about one other: roughly size * 11 occurrences (after exceptions) to check for
+# conflicts, and a few conflicts for every ten of them.
+def conflicts_workload(size):
+    events = []
+    for i in range(size):
+        start = 8 * 60 + i * 7919 % (10 * 60 - 45)
+        end = start + 45
+        events.append({"summary": f"Lesson {i}", "date": day_string(i), "start_time": f"{start // 60:02d}:{start % 60:02d}",
+                       "end_time": f"{end // 60:02d}:{end % 60:02d}",
+                       "recurrence": {"freq": "WEEKLY", "interval": 1, "count": 12}})
+    exceptions = [{"date_start": day_string(offset), "date_end": day_string(offset + 13)} for offset in range(0, 3650, 180)]
+    return events, exceptions
+
+
+# Conflict report over the whole range of conflicts_workload: index build, then the sweep line
+# over every occurrence. For scale, pairwise comparison of the same occurrences would take
+# n * (n - 1) / 2 checks.
+def bench_conflicts(args):
+    events, exceptions = conflicts_workload(args.size)
+    last_day = FIRST_DAY + timedelta(days=args.size + 12 * 7)
+    build = best_time(lambda: OccurrenceIndex(events, exceptions), args.repeat)
+    index = OccurrenceIndex(events, exceptions)
+    occurrences = list(index.between(FIRST_DAY, last_day))
+    conflicts = sum(1 for _ in find_conflicts(occurrences))
+    if not conflicts:
+        raise AssertionError("the conflicts workload has no conflicts to report")
+    sweep = best_time(lambda: sum(1 for _ in find_conflicts(occurrences)), args.repeat)
+    total = best_time(lambda: sum(1 for _ in index.conflicts(FIRST_DAY, last_day)), args.repeat)
+    n = len(occurrences)
+    print(f"{n} occurrences, {conflicts} conflicts ({n * (n - 1) // 2:.2e} pairs to compare pairwise)")
+    print(f"{'index':>12}: {build:8.3f}s")
+    print(f"{'sweep':>12}: {sweep:8.3f}s  {n / sweep:12.0f} occurrences/s")
+    print(f"{'expand+sweep':>12}: {total:8.3f}s  {n / total:12.0f} occurrences/s")
+
+
+# Wall time of short command line runs, each in a fresh interpreter: what a script calling the
+# tool once per small file pays per call. "import icalendar" is what every run paid before the
+# heavy imports were deferred.
+def bench_startup(args):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "generate_ics.py")
+    events, exceptions = single_day_workload(10)
+    with tempfile.TemporaryDirectory() as tmp:
+        input_file = os.path.join(tmp, "events.json")
+        with open(input_file, "w", encoding="utf-8") as f:
+            json.dump({"events": events, "exceptions": exceptions}, f)
+        output_file = os.path.join(tmp, "events.ics")
+        commands = {
+            "python": [sys.executable, "-c", "pass"],
+            "import icalendar": [sys.executable, "-c", "import icalendar"],
+            "--help": [sys.executable, script, "--help"],
+            "--check": [sys.executable, script, input_file, "--check"],
+            "convert native": [sys.executable, script, input_file, output_file, "--no-cache", "--serializer", "native"],
+            "convert": [sys.executable, script, input_file, output_file, "--no-cache"],
+        }
+        for name, command in commands.items():
+            seconds = best_time(lambda: subprocess.run(command, check=True, stdout=subprocess.DEVNULL),
+                                max(args.repeat, 5))
+            print(f"{name:>16}: {seconds * 1000:8.1f} ms")
+
+
+# Current commit, if this is a git checkout
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Every workload at every size: wall time, occurrences per second and peak memory.
+# Results can be saved as JSON (--output) and compared against an earlier run (--compare).
+def bench_suite(args):
+    workloads = args.workloads or list(WORKLOADS)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        output_file = os.path.join(tmp, "bench.ics")
+        for name in workloads:
+            for size in args.sizes:
+                events, exceptions = WORKLOADS[name](size)
+
+                def run():
+                    create_ics(events, output_file, exceptions, serializer=args.serializer, streaming=True)
+
+                seconds = best_time(run, args.repeat)
+                result = {
+                    "workload": name,
+                    "size": size,
+                    "serializer": args.serializer,
+                    "seconds": round(seconds, 6),
+                    "events_per_second": round(size / seconds, 1),
+                    "peak_memory_bytes": None if args.no_memory else peak_memory(run),
+                    "output_bytes": os.path.getsize(output_file),
+                }
+                results.append(result)
+                memory = "" if args.no_memory else f"  {result['peak_memory_bytes'] / 1e6:8.1f} MB peak"
+                print(f"{name:>12} {size:>9}: {seconds:8.3f}s  {result['events_per_second']:12.0f} events/s{memory}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = {(r["workload"], r["size"], r["serializer"]): r for r in json.load(f)["results"]}
+        print(f"== compared to {args.compare}")
+        for result in results:
+            before = baseline.get((result["workload"], result["size"], result["serializer"]))
+            if before:
+                change = result["seconds"] / before["seconds"] - 1
+                print(f"{result['workload']:>12} {result['size']:>9}: {change:+8.1%} time")
+
+    if args.output:
+        report = {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+BENCHMARKS = {
+    "conflicts": bench_conflicts,
+    "loaders": bench_loaders,
+    "parallel": bench_parallel,
+    "serializers": bench_serializers,
+    "startup": bench_startup,
+    "suite": bench_suite,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for generate_ics.py.")
+    parser.add_argument("benchmark", nargs="*",
+                        help=f"Benchmarks to run (default: all). One of: {', '.join(sorted(BENCHMARKS))}.")
+    parser.add_argument("--size", type=int, default=10000, help="Workload size for single-size benchmarks.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement; the best is reported.")
+    suite = parser.add_argument_group("suite options")
+    suite.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                       help="Workload sizes (default: %(default)s). 1000000 works too, given time.")
+    suite.add_argument("--workloads", nargs="+", choices=list(WORKLOADS), help="Workloads to run (default: all).")
+    suite.add_argument("--serializer", choices=["icalendar", "native"], default="native",
+                       help="Serializer to measure (default: %(default)s).")
+    suite.add_argument("--no-memory", action="store_true", help="Skip the (slower) traced run measuring peak memory.")
+    suite.add_argument("--output", help="Write the results as JSON to this file.")
+    suite.add_argument("--compare", help="JSON results of an earlier run to compare against.")
+    args = parser.parse_args()
+    for name in args.benchmark:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name!r}")
+
+    for name in args.benchmark or sorted(BENCHMARKS):
+        print(f"== {name}")
+        BENCHMARKS[name](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,53 @@
 import unittest
+import contextlib
+import csv
+import io
+import json
 import os
-from generate_ics import create_ics
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import types
+import urllib.error
+import urllib.request
+from datetime import date, datetime, time, timedelta
+import generate_ics
+from generate_ics import (
+    batch_jobs,
+    cache_path,
+    CalendarService,
+    check_input,
+    create_ics,
+    drop_exception_days,
+    event_uid,
+    event_vevent_data,
+    ExceptionIndex,
+    find_conflicts,
+    fold_line,
+    iter_vevent_data,
+    load_input,
+    main,
+    make_server,
+    merge_inputs,
+    normalize_event,
+    numpy_module,
+    Occurrence,
+    OccurrenceIndex,
+    parse_date,
+    parse_dates,
+    parse_time,
+    recurrence_rrule,
+    recurrence_starts,
+    rrule_exdates,
+    run_batch,
+    serialize_vevent,
+    Stats,
+    VEventCache,
+    VEventData,
+    write_calendar_stream,
+)
 from icalendar import Calendar
 
 
@@ -363,5 +410,1506 @@ class TestGenerateICS(unittest.TestCase):
                     self.assertIn("20230102", exdate_dates)
                     self.assertIn("20230105", exdate_dates)
 
+    def test_streaming_output_matches_in_memory_output(self):
+        streamed_file = "test_output_streamed.ics"
+        try:
+            create_ics(self.events, self.output_file, self.exceptions)
+            create_ics(self.events, streamed_file, self.exceptions, streaming=True)
+            with open(self.output_file, 'rb') as f:
+                expected = f.read()
+            with open(streamed_file, 'rb') as f:
+                streamed = f.read()
+        finally:
+            if os.path.exists(streamed_file):
+                os.remove(streamed_file)
+        self.assertEqual(streamed, expected)
+
+    def test_streaming_writes_each_event_as_it_is_generated(self):
+        buffer = io.BytesIO()
+        written_before_event = []
+
+        def events():
+            for day in range(1, 4):
+                # Record how much output exists before each event is handed over
+                written_before_event.append(buffer.tell())
+                yield {"summary": f"Event {day}", "date": f"0{day}.01.2023"}
+
+        write_calendar_stream(buffer, map(generate_ics.SERIALIZERS["icalendar"], iter_vevent_data(events(), ExceptionIndex())))
+        self.assertEqual(len(written_before_event), 3)
+        # The header is written before the first event, and each earlier event before the next one
+        self.assertLess(written_before_event[0], written_before_event[1])
+        self.assertLess(written_before_event[1], written_before_event[2])
+        self.assertLess(written_before_event[2], len(buffer.getvalue()))
+        parsed = Calendar.from_ical(buffer.getvalue())
+        self.assertEqual([str(c.get("SUMMARY")) for c in parsed.walk("VEVENT")], ["Event 1", "Event 2", "Event 3"])
+
+class TestNativeSerializer(unittest.TestCase):
+    golden_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testdata", "golden_native.ics")
+
+    def setUp(self):
+        self.output_file = "test_output.ics"
+        self.events = [
+            {"summary": "Single Day Event", "date": "01.01.2023"},
+            {"summary": "Timed Event", "date": "06.01.2023", "start_time": "10:00", "end_time": "12:00",
+             "description": "Bring: shoes, water; snacks\nand a \\ backslash"},
+            {"summary": "Multi Day Event", "date_start": "01.01.2023", "date_end": "10.01.2023"},
+            {"summary": "Multi Day Event with Time", "date_start": "01.01.2023", "date_end": "10.01.2023",
+             "start_time": "09:00", "end_time": "17:00"},
+            {"summary": "Recurring Event", "date": "01.01.2023",
+             "recurrence": {"freq": "WEEKLY", "interval": 2, "until": "01.06.2023"}},
+            {"summary": "Recurring Event with Time", "date": "01.01.2023", "start_time": "08:00", "end_time": "09:00",
+             "recurrence": {"freq": "DAILY", "interval": 1, "count": 5}},
+            {"summary": "Weihnachtssingen für die ganze Familie – mit Glühwein, Plätzchen und Überraschungsgästen",
+             "dates": ["01.01.2023", "05.01.2023", "10.01.2023"],
+             "description": "Ü" * 60},
+        ]
+        self.exceptions = [
+            {"date_start": "02.01.2023", "date_end": "05.01.2023"},
+            {"date_start": "07.01.2023", "date_end": "07.01.2023"},
+        ]
+
+    def tearDown(self):
+        if os.path.exists(self.output_file):
+            os.remove(self.output_file)
+
+    def read_output(self, serializer):
+        create_ics(self.events, self.output_file, self.exceptions, serializer=serializer)
+        with open(self.output_file, 'rb') as f:
+            return f.read()
+
+    # Compare parsed components rather than bytes: property names, parameters and decoded values
+    def components(self, ical_content):
+        parsed = []
+        for component in Calendar.from_ical(ical_content).walk("VEVENT"):
+            properties = []
+            for name, value in component.property_items(recursive=False):
+                if name in ("BEGIN", "END"):
+                    continue
+                properties.append((name, dict(value.params) if hasattr(value, "params") else {}, value.to_ical()))
+            parsed.append(sorted(properties))
+        return parsed
+
+    def test_native_output_matches_golden_file(self):
+        with open(self.golden_file, 'rb') as f:
+            golden = f.read()
+        self.assertEqual(self.read_output("native"), golden)
+
+    def test_golden_file_parses_to_icalendar_components(self):
+        with open(self.golden_file, 'rb') as f:
+            golden = f.read()
+        self.assertEqual(self.components(golden), self.components(self.read_output("icalendar")))
+
+    def test_native_output_matches_icalendar_output(self):
+        self.assertEqual(self.read_output("native"), self.read_output("icalendar"))
+
+    def test_escaping(self):
+        data = VEventData("a;b,c\\d\ne", None, date(2023, 1, 1), date(2023, 1, 2), None, None)
+        self.assertIn(b"SUMMARY;CHARSET=UTF-8:a\\;b\\,c\\\\d\\ne\r\n", serialize_vevent(data))
+
+    def test_line_folding(self):
+        line = ("SUMMARY:" + "ä" * 100).encode("utf-8")
+        folded = fold_line(line)
+        physical_lines = folded.split(b"\r\n")[:-1]
+        self.assertGreater(len(physical_lines), 1)
+        for physical_line in physical_lines:
+            self.assertLessEqual(len(physical_line), 75)
+            # Never split inside a multi-byte character
+            physical_line.decode("utf-8")
+        for continuation in physical_lines[1:]:
+            self.assertTrue(continuation.startswith(b" "))
+        self.assertEqual(folded.replace(b"\r\n ", b""), line + b"\r\n")
+
+    def test_short_lines_are_not_folded(self):
+        self.assertEqual(fold_line(b"x" * 74), b"x" * 74 + b"\r\n")
+
+    def test_unknown_serializer(self):
+        with self.assertRaises(ValueError):
+            create_ics(self.events, self.output_file, serializer="fast")
+
+class TestCompactDates(unittest.TestCase):
+
+    def setUp(self):
+        self.output_file = "test_output.ics"
+        self.exceptions = [{"date_start": "05.01.2023", "date_end": "05.01.2023"}]
+
+    def tearDown(self):
+        if os.path.exists(self.output_file):
+            os.remove(self.output_file)
+
+    def vevents(self, event, serializer="icalendar"):
+        create_ics([event], self.output_file, self.exceptions, compact_dates=True, serializer=serializer)
+        with open(self.output_file, 'rb') as f:
+            ical_content = f.read()
+        return ical_content, list(Calendar.from_ical(ical_content).walk("VEVENT"))
+
+    def test_all_day_dates(self):
+        event = {"summary": "Training", "dates": ["10.01.2023", "01.01.2023", "05.01.2023", "20.01.2023"]}
+        ical_content, components = self.vevents(event)
+        self.assertEqual(len(components), 1)
+        component = components[0]
+        self.assertEqual(component.get("DTSTART").dt, date(2023, 1, 1))
+        self.assertEqual(component.get("DTEND").dt, date(2023, 1, 2))
+        self.assertEqual([dt.dt for dt in component.get("RDATE").dts], [date(2023, 1, 10), date(2023, 1, 20)])
+        self.assertIsNone(component.get("EXDATE"))
+        self.assertIn(b"RDATE;VALUE=DATE:20230110,20230120\r\n", ical_content)
+
+    def test_timed_dates(self):
+        event = {"summary": "Training", "dates": ["01.01.2023", "05.01.2023", "10.01.2023"],
+                 "start_time": "17:00", "end_time": "18:30", "description": "Halle 2"}
+        ical_content, components = self.vevents(event)
+        self.assertEqual(len(components), 1)
+        component = components[0]
+        self.assertEqual(component.get("DTSTART").dt.strftime("%Y%m%dT%H%M%S"), "20230101T170000")
+        self.assertEqual(component.get("DTEND").dt.strftime("%Y%m%dT%H%M%S"), "20230101T183000")
+        self.assertEqual(component.get("DESCRIPTION"), "Halle 2")
+        self.assertIn(b"RDATE:20230110T170000\r\n", ical_content)
+
+    def test_only_one_date_left(self):
+        event = {"summary": "Training", "dates": ["05.01.2023", "10.01.2023"]}
+        ical_content, components = self.vevents(event)
+        self.assertEqual(len(components), 1)
+        self.assertEqual(components[0].get("DTSTART").dt, date(2023, 1, 10))
+        self.assertNotIn(b"RDATE", ical_content)
+
+    def test_all_dates_excepted(self):
+        ical_content, components = self.vevents({"summary": "Training", "dates": ["05.01.2023"]})
+        self.assertEqual(components, [])
+
+    def test_native_serializer_matches(self):
+        for event in [
+            {"summary": "Training", "dates": ["01.01.2023", "10.01.2023", "20.01.2023"]},
+            {"summary": "Training", "dates": ["01.01.2023", "10.01.2023"], "start_time": "17:00", "end_time": "18:30"},
+        ]:
+            self.assertEqual(self.vevents(event, "native")[0], self.vevents(event, "icalendar")[0])
+
+    def test_without_compact_dates(self):
+        event = {"summary": "Training", "dates": ["01.01.2023", "10.01.2023"]}
+        create_ics([event], self.output_file, self.exceptions)
+        with open(self.output_file, 'rb') as f:
+            self.assertEqual(len(Calendar.from_ical(f.read()).walk("VEVENT")), 2)
+
+class TestLoaders(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+    def test_python_file(self):
+        path = self.write("events.py", """
+# Comments are fine
+events = [
+    {"summary": "Trödelmarkt", "date": "18.10.2024", "start_time": "10:00", "end_time": "12:00"},
+    {"summary": "Biweekly", "date": "01.02.2025", "recurrence": {"freq": "WEEKLY", "interval": 2}},
+]
+exceptions = [{"date_start": "02.01.2023", "date_end": "02.01.2023"}]
+""")
+        events, exceptions = load_input(path)
+        self.assertEqual(events[0]["summary"], "Trödelmarkt")
+        self.assertEqual(events[1]["recurrence"], {"freq": "WEEKLY", "interval": 2})
+        self.assertEqual(exceptions, [{"date_start": "02.01.2023", "date_end": "02.01.2023"}])
+
+    def test_python_naked_array(self):
+        path = self.write("events.txt", '[{"summary": "A", "date": "01.01.2023"}]')
+        self.assertEqual(load_input(path), ([{"summary": "A", "date": "01.01.2023"}], []))
+
+    def test_example_file(self):
+        example = os.path.join(os.path.dirname(os.path.abspath(__file__)), "events-array.example.py")
+        events, exceptions = load_input(example)
+        self.assertEqual(len(events), 4)
+        self.assertEqual(len(exceptions), 2)
+
+    def test_python_file_does_not_run_code(self):
+        for content in [
+            "import os\nevents = []",
+            "events = [__import__('os').system('true')]",
+            "events = [{'summary': 'A', 'date': '01.01.2023'}]\nprint('hello')",
+        ]:
+            with self.assertRaises(ValueError):
+                load_input(self.write("events.py", content))
+
+    def test_python_syntax_error(self):
+        path = self.write("events.py", "events = [\n    {'summary': 'A',, 'date': '01.01.2023'}]\n")
+        with self.assertRaisesRegex(ValueError, r"events\.py, line 2: "):
+            load_input(path)
+        output_file = os.path.join(self.tmp_dir, "events.ics")
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertEqual(main([path, output_file, "--no-cache"]), 1)
+            self.assertEqual(main([path, "--check"]), 1)
+        self.assertEqual(output.getvalue().count(f"Error: {path}, line 2: "), 2)
+
+    def test_python_file_without_events(self):
+        with self.assertRaisesRegex(ValueError, "no 'events' array"):
+            load_input(self.write("events.py", "exceptions = []"))
+
+    def test_json_file(self):
+        path = self.write("events.json", json.dumps({
+            "events": [{"summary": "A", "date": "01.01.2023"}],
+            "exceptions": [{"date_start": "02.01.2023", "date_end": "02.01.2023"}],
+        }))
+        events, exceptions = load_input(path)
+        self.assertEqual(events, [{"summary": "A", "date": "01.01.2023"}])
+        self.assertEqual(len(exceptions), 1)
+        self.assertEqual(load_input(self.write("naked.json", "[]")), ([], []))
+
+    def test_csv_file(self):
+        path = self.write("events.csv", "\n".join([
+            "kind,summary,date,date_start,date_end,dates,start_time,end_time,freq,interval,count,until",
+            ",Single,01.01.2023,,,,10:00,12:00,,,,",
+            "event,Multi,,01.01.2023,03.01.2023,,,,,,,",
+            ",Several,,,,01.01.2023; 05.01.2023 10.01.2023,,,,,,",
+            ",Recurring,01.01.2023,,,,,,WEEKLY,2,,01.06.2023",
+            ",Counted,01.01.2023,,,,,,DAILY,,5,",
+            "exception,Holiday,,02.01.2023,02.01.2023,,,,,,,",
+        ]))
+        events, exceptions = load_input(path)
+        self.assertEqual(events, [
+            {"summary": "Single", "date": "01.01.2023", "start_time": "10:00", "end_time": "12:00"},
+            {"summary": "Multi", "date_start": "01.01.2023", "date_end": "03.01.2023"},
+            {"summary": "Several", "dates": ["01.01.2023", "05.01.2023", "10.01.2023"]},
+            {"summary": "Recurring", "date": "01.01.2023",
+             "recurrence": {"freq": "WEEKLY", "interval": 2, "until": "01.06.2023"}},
+            {"summary": "Counted", "date": "01.01.2023", "recurrence": {"freq": "DAILY", "count": 5, "interval": 1}},
+        ])
+        self.assertEqual(exceptions, [{"summary": "Holiday", "date_start": "02.01.2023", "date_end": "02.01.2023"}])
+
+    def test_csv_invalid_interval(self):
+        path = self.write("events.csv", "summary,date,freq,interval\nA,01.01.2023,DAILY,often\n")
+        with self.assertRaisesRegex(ValueError, "line 2"):
+            load_input(path)
+
+    def test_ndjson_file_is_read_lazily(self):
+        path = self.write("events.ndjson", "\n".join([
+            '{"kind": "exception", "date_start": "02.01.2023", "date_end": "02.01.2023"}',
+            '{"summary": "A", "date": "01.01.2023"}',
+            '',
+            '{"summary": "B", "date": "02.01.2023"}',
+        ]) + "\n")
+        events, exceptions = load_input(path)
+        self.assertIsInstance(events, types.GeneratorType)
+        self.assertEqual(exceptions, [{"date_start": "02.01.2023", "date_end": "02.01.2023"}])
+        self.assertEqual(next(events), {"summary": "A", "date": "01.01.2023"})
+        self.assertEqual(list(events), [{"summary": "B", "date": "02.01.2023"}])
+
+    def test_ndjson_exception_after_events(self):
+        path = self.write("events.jsonl", "\n".join([
+            '{"summary": "A", "date": "01.01.2023"}',
+            '{"kind": "exception", "date_start": "02.01.2023", "date_end": "02.01.2023"}',
+        ]))
+        events, exceptions = load_input(path)
+        with self.assertRaisesRegex(ValueError, "line 2: exceptions must come before the first event"):
+            list(events)
+
+    def test_ndjson_invalid_line(self):
+        path = self.write("events.ndjson", '{"summary": "A", "date": "01.01.2023"}\n[1, 2]\n')
+        events, exceptions = load_input(path)
+        with self.assertRaisesRegex(ValueError, "line 2: expected a JSON object"):
+            list(events)
+
+    def test_ndjson_invalid_header_closes_file(self):
+        import gc, warnings
+        path = self.write("events.ndjson", '{"kind": "exception", "date_start": "02.01.2023"\n')
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always", ResourceWarning)
+            with self.assertRaisesRegex(ValueError, "line 1"):
+                load_input(path)
+            gc.collect()
+        self.assertEqual([w for w in caught if issubclass(w.category, ResourceWarning)], [])
+
+    def test_ndjson_to_ics(self):
+        path = self.write("events.ndjson", "\n".join(
+            json.dumps({"summary": f"Event {day}", "date": f"{day:02d}.01.2023"}) for day in range(1, 11)))
+        output_file = os.path.join(self.tmp_dir, "output.ics")
+        events, exceptions = load_input(path)
+        create_ics(events, output_file, exceptions, streaming=True)
+        with open(output_file, 'rb') as f:
+            self.assertEqual(len(Calendar.from_ical(f.read()).walk("VEVENT")), 10)
+
+    def test_explicit_format(self):
+        path = self.write("events.txt", '{"summary": "A", "date": "01.01.2023"}\n')
+        events, exceptions = load_input(path, "ndjson")
+        self.assertEqual(list(events), [{"summary": "A", "date": "01.01.2023"}])
+        with self.assertRaises(ValueError):
+            load_input(path, "yaml")
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.tmp_dir, "inputs")
+        os.mkdir(self.input_dir)
+        self.write("club.py", 'events = [{"summary": "Club", "date": "01.01.2023"}]')
+        self.write("school.json", '{"events": [{"summary": "School", "date_start": "01.01.2023", "date_end": "03.01.2023"}]}')
+        self.write("notes.txt", "not an input file")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, content):
+        with open(os.path.join(self.input_dir, name), "w", encoding="utf-8") as f:
+            f.write(content)
+
+    def run_main(self, argv):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            status = main(argv + ["--cache-dir", os.path.join(self.tmp_dir, "cache")])
+        return status, output.getvalue()
+
+    def test_directory_jobs(self):
+        output_dir = os.path.join(self.tmp_dir, "out")
+        self.assertEqual(batch_jobs(self.input_dir, output_dir), [
+            (os.path.join(self.input_dir, "club.py"), os.path.join(output_dir, "club.ics")),
+            (os.path.join(self.input_dir, "school.json"), os.path.join(output_dir, "school.ics")),
+        ])
+
+    def test_manifest_jobs(self):
+        manifest = os.path.join(self.tmp_dir, "manifest.json")
+        with open(manifest, "w") as f:
+            json.dump({"inputs/club.py": "club-calendar.ics"}, f)
+        self.assertEqual(batch_jobs(manifest), [
+            (os.path.join(self.tmp_dir, "inputs/club.py"), os.path.join(self.tmp_dir, "club-calendar.ics")),
+        ])
+        with open(manifest, "w") as f:
+            json.dump([["inputs/club.py", "a.ics"], ["inputs/school.json", "b.ics"]], f)
+        self.assertEqual([output for _, output in batch_jobs(manifest, "out")], [os.path.join("out", "a.ics"), os.path.join("out", "b.ics")])
+
+    def test_batch_directory(self):
+        output_dir = os.path.join(self.tmp_dir, "out")
+        status, output = self.run_main(["batch", self.input_dir, "--output-dir", output_dir])
+        self.assertEqual(status, 0)
+        self.assertIn("2 succeeded, 0 failed", output)
+        self.assertEqual(sorted(os.listdir(output_dir)), ["club.ics", "school.ics"])
+
+    def test_batch_reports_failures(self):
+        self.write("broken.py", "events = [{'summary': 'Broken', 'date': '32.01.2023'}]")
+        status, output = self.run_main(["batch", self.input_dir])
+        self.assertEqual(status, 1)
+        self.assertIn("FAILED  " + os.path.join(self.input_dir, "broken.py") + ": ValueError: Invalid date '32.01.2023'", output)
+        self.assertIn("2 succeeded, 1 failed", output)
+        self.assertTrue(os.path.exists(os.path.join(self.input_dir, "club.ics")))
+
+    def test_batch_with_workers(self):
+        jobs = batch_jobs(self.input_dir, self.tmp_dir)
+        jobs.append((os.path.join(self.input_dir, "missing.py"), os.path.join(self.tmp_dir, "missing.ics")))
+        results = run_batch(jobs, workers=2, options={"serializer": "native"})
+        self.assertEqual([os.path.basename(output) for _, output, _ in results], ["club.ics", "school.ics", "missing.ics"])
+        self.assertIsNone(results[0][2])
+        self.assertIsNone(results[1][2])
+        self.assertTrue(results[2][2].startswith("FileNotFoundError"))
+        with open(os.path.join(self.tmp_dir, "club.ics"), "rb") as f:
+            self.assertIn(b"SUMMARY;CHARSET=UTF-8:Club", f.read())
+
+    def test_missing_source(self):
+        status, output = self.run_main(["batch", os.path.join(self.tmp_dir, "nope.json")])
+        self.assertEqual(status, 1)
+        self.assertIn("Error:", output)
+
+class TestUIDs(unittest.TestCase):
+
+    def uids(self, events, **options):
+        output_file = "test_output.ics"
+        try:
+            create_ics(events, output_file, **options)
+            with open(output_file, 'rb') as f:
+                return [str(c.get("UID")) for c in Calendar.from_ical(f.read()).walk("VEVENT")]
+        finally:
+            os.remove(output_file)
+
+    def test_uids_are_stable(self):
+        event = {"summary": "Piano", "date": "01.01.2023", "recurrence": {"freq": "WEEKLY", "interval": 1}}
+        self.assertEqual(self.uids([event]), self.uids([dict(reversed(list(event.items())))]))
+        self.assertEqual(self.uids([event]), [event_uid(event)])
+        self.assertTrue(event_uid(event).endswith("@ical-creator"))
+
+    def test_uids_follow_content(self):
+        event = {"summary": "Piano", "date": "01.01.2023"}
+        self.assertNotEqual(event_uid(event), event_uid(dict(event, summary="Guitar")))
+        # Keys the tool does not use do not affect the UID
+        self.assertEqual(event_uid(event), event_uid(dict(event, notes="ignored")))
+
+    def test_each_date_gets_its_own_uid(self):
+        event = {"summary": "Training", "dates": ["01.01.2023", "05.01.2023"]}
+        uids = self.uids([event])
+        self.assertEqual(len(set(uids)), 2)
+        self.assertTrue(uids[0].endswith("-20230101@ical-creator"))
+        self.assertEqual(len(self.uids([event], compact_dates=True)), 1)
+
+    def test_duplicates_get_distinct_uids(self):
+        lesson = {"summary": "Piano", "date": "01.01.2023", "recurrence": {"freq": "WEEKLY", "interval": 1}}
+        training = {"summary": "Training", "dates": ["01.01.2023", "05.01.2023", "01.01.2023"]}
+        events = [lesson, training, dict(lesson), dict(training)]
+        uid = event_uid(lesson)
+        expected = self.uids(events)
+        self.assertEqual(len(set(expected)), 8)
+        self.assertEqual([expected[0], expected[4]], [uid, uid.replace("@", "-2@")])
+        self.assertTrue(expected[3].endswith("-20230101-2@ical-creator"))
+        self.assertTrue(expected[5].endswith("-2-20230101@ical-creator"))
+        self.assertEqual(len(set(self.uids(events, compact_dates=True))), 4)
+        cache_dir = tempfile.mkdtemp()
+        try:
+            for options in [{"serializer": "native"}, {"workers": 2}, {"cache": VEventCache(os.path.join(cache_dir, "cache"))},
+                            {"cache": VEventCache(os.path.join(cache_dir, "cache"))}]:
+                self.assertEqual(self.uids(events, **options), expected)
+        finally:
+            shutil.rmtree(cache_dir)
+
+class TestVEventCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output_file = os.path.join(self.tmp_dir, "output.ics")
+        self.cache_file = cache_path(os.path.join(self.tmp_dir, "cache"), self.output_file)
+        self.events = [{"summary": f"Event {day}", "date": f"{day:02d}.01.2023"} for day in range(1, 21)]
+        self.events.append({"summary": "Weekly", "date": "01.01.2023", "recurrence": {"freq": "WEEKLY", "interval": 1}})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def run_cached(self, events, exceptions=[], **options):
+        cache = VEventCache(self.cache_file)
+        create_ics(events, self.output_file, exceptions, cache=cache, **options)
+        with open(self.output_file, 'rb') as f:
+            return cache, f.read()
+
+    def uncached_output(self, events, exceptions=[], **options):
+        create_ics(events, self.output_file, exceptions, **options)
+        with open(self.output_file, 'rb') as f:
+            return f.read()
+
+    def test_second_run_hits_cache(self):
+        cache, first = self.run_cached(self.events)
+        self.assertEqual((cache.hits, cache.misses), (0, 21))
+        cache, second = self.run_cached(self.events)
+        self.assertEqual((cache.hits, cache.misses), (21, 0))
+        self.assertEqual(first, second)
+        self.assertEqual(second, self.uncached_output(self.events))
+
+    def test_only_edited_event_is_serialized_again(self):
+        self.run_cached(self.events, serializer="native")
+        self.events[7] = dict(self.events[7], description="Edited")
+        cache, output = self.run_cached(self.events, serializer="native")
+        self.assertEqual((cache.hits, cache.misses), (20, 1))
+        self.assertEqual(output, self.uncached_output(self.events, serializer="native"))
+
+    def test_exception_changes_only_invalidate_affected_events(self):
+        self.run_cached(self.events)
+        exceptions = [{"date_start": "10.01.2023", "date_end": "10.01.2023"}]
+        cache, output = self.run_cached(self.events, exceptions)
+        # The event on the 10th and the open-ended weekly event are affected
+        self.assertEqual((cache.hits, cache.misses), (19, 2))
+        self.assertEqual(output, self.uncached_output(self.events, exceptions))
+
+    def test_exception_after_until(self):
+        events = [{"summary": "Weekly", "date": "02.01.2023", "recurrence": {"freq": "WEEKLY", "interval": 1, "until": "01.02.2023"}}]
+        self.run_cached(events, [{"date_start": "01.03.2023", "date_end": "01.03.2023"}])
+        exceptions = [{"date_start": "02.03.2023", "date_end": "02.03.2023"}]
+        # Unpruned, every exception day after the start is an EXDATE, even after UNTIL
+        cache, output = self.run_cached(events, exceptions)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        self.assertIn(b"EXDATE;VALUE=DATE:20230302", output)
+        self.assertEqual(output, self.uncached_output(events, exceptions))
+        # Pruned, exceptions after UNTIL can't change anything
+        self.run_cached(events, exceptions, prune_exdates=True)
+        cache, output = self.run_cached(events, [{"date_start": "03.03.2023", "date_end": "03.03.2023"}], prune_exdates=True)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+    def test_stale_entries_are_dropped(self):
+        self.run_cached(self.events)
+        self.run_cached(self.events[:3])
+        self.assertEqual(len(VEventCache(self.cache_file).entries), 3)
+
+    def test_failed_run_keeps_cache(self):
+        self.run_cached(self.events)
+        with open(self.cache_file, 'rb') as f:
+            content = f.read()
+        with self.assertRaisesRegex(ValueError, "Invalid date"):
+            self.run_cached(self.events + [{"summary": "Broken", "date": "32.01.2023"}])
+        with open(self.cache_file, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(os.listdir(os.path.dirname(self.cache_file)), [os.path.basename(self.cache_file)])
+
+    def test_cache_replaced_during_run(self):
+        self.run_cached(self.events)
+        cache = VEventCache(self.cache_file)
+        # Another run rewrites the cache after this one indexed it, moving its entries around
+        self.run_cached(self.events[::-1][:10])
+        create_ics(self.events, self.output_file, cache=cache)
+        with open(self.output_file, 'rb') as f:
+            self.assertEqual(f.read(), self.uncached_output(self.events))
+        self.assertEqual((cache.hits, cache.misses), (0, 21))
+
+    def test_other_tool_version_invalidates_cache(self):
+        self.run_cached(self.events)
+        with open(self.cache_file, 'rb') as f:
+            content = f.read()
+        with open(self.cache_file, 'wb') as f:
+            f.write(content.replace(b"VEVENT cache", b"VEVENT cache 0.0.1 was", 1))
+        cache, output = self.run_cached(self.events)
+        self.assertEqual((cache.hits, cache.misses), (0, 21))
+
+    def test_corrupt_cache_is_ignored(self):
+        self.run_cached(self.events)
+        with open(self.cache_file, 'r+b') as f:
+            f.truncate(os.path.getsize(self.cache_file) // 2)
+        cache, output = self.run_cached(self.events)
+        self.assertEqual(output, self.uncached_output(self.events))
+
+    def test_cli_no_cache(self):
+        input_file = os.path.join(self.tmp_dir, "events.json")
+        with open(input_file, "w") as f:
+            json.dump(self.events, f)
+        cache_dir = os.path.join(self.tmp_dir, "cli-cache")
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            main([input_file, self.output_file, "--cache-dir", cache_dir])
+            main([input_file, self.output_file, "--cache-dir", cache_dir])
+            main([input_file, self.output_file, "--cache-dir", cache_dir, "--no-cache"])
+        self.assertIn("Event cache: 21 hits, 0 misses", output.getvalue())
+        self.assertEqual(output.getvalue().count("Event cache"), 2)
+
+class TestParallel(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output_file = os.path.join(self.tmp_dir, "output.ics")
+        self.events = []
+        for day in range(1, 29):
+            self.events.append({"summary": f"Single {day}", "date": f"{day:02d}.02.2023", "start_time": "10:00", "end_time": "11:00"})
+            self.events.append({"summary": f"Dates {day}", "dates": [f"{day:02d}.03.2023", f"{day:02d}.04.2023"]})
+        self.events.append({"summary": "Multi", "date_start": "01.01.2023", "date_end": "10.01.2023"})
+        self.events.append({"summary": "Weekly", "date": "01.01.2023", "recurrence": {"freq": "WEEKLY", "interval": 1}})
+        self.exceptions = [{"date_start": "05.01.2023", "date_end": "15.02.2023"}, {"date_start": "10.04.2023", "date_end": "12.04.2023"}]
+        self.original_chunk_size = generate_ics.PARALLEL_CHUNK_SIZE
+        # Small chunks so the events are spread over many work items
+        generate_ics.PARALLEL_CHUNK_SIZE = 7
+
+    def tearDown(self):
+        generate_ics.PARALLEL_CHUNK_SIZE = self.original_chunk_size
+        shutil.rmtree(self.tmp_dir)
+
+    def output(self, events, **options):
+        create_ics(events, self.output_file, self.exceptions, **options)
+        with open(self.output_file, 'rb') as f:
+            return f.read()
+
+    def test_parallel_output_matches_serial_output(self):
+        for options in [{}, {"serializer": "native"}, {"prune_exdates": True, "compact_dates": True}]:
+            self.assertEqual(self.output(self.events, workers=3, **options), self.output(self.events, **options))
+
+    def test_parallel_with_lazy_events(self):
+        self.assertEqual(self.output(iter(self.events), workers=2), self.output(self.events))
+
+    def test_parallel_with_cache(self):
+        cache_file = os.path.join(self.tmp_dir, "events.cache")
+        expected = self.output(self.events)
+        cache = VEventCache(cache_file)
+        self.assertEqual(self.output(self.events, workers=2, cache=cache), expected)
+        self.events[10] = dict(self.events[10], summary="Edited")
+        cache = VEventCache(cache_file)
+        self.assertEqual(self.output(self.events, workers=2, cache=cache), self.output(self.events))
+        self.assertEqual((cache.hits, cache.misses), (len(self.events) - 1, 1))
+
+class TestParsing(unittest.TestCase):
+
+    def test_parse_date(self):
+        self.assertEqual(parse_date("01.02.2023"), date(2023, 2, 1))
+        self.assertEqual(parse_date("1.2.2023"), date(2023, 2, 1))
+
+    def test_parse_time(self):
+        self.assertEqual(parse_time("08:05"), time(8, 5))
+        self.assertEqual(parse_time("8:05"), time(8, 5))
+        self.assertEqual(parse_time("8:5"), time(8, 5))
+        self.assertEqual(parse_time("23:59"), time(23, 59))
+
+    def test_invalid_dates(self):
+        for value in ["2023-01-01", "01.01.23", "01.01.2023 ", "aa.bb.cccc", "", None]:
+            with self.assertRaisesRegex(ValueError, "expected DD.MM.YYYY"):
+                parse_date(value)
+        with self.assertRaisesRegex(ValueError, "Invalid date '31.02.2023': day is out of range"):
+            parse_date("31.02.2023")
+
+    def test_invalid_times(self):
+        for value in ["8", "08:005", "08.00", "08:00:00", None]:
+            with self.assertRaisesRegex(ValueError, "expected HH:MM"):
+                parse_time(value)
+        with self.assertRaisesRegex(ValueError, "Invalid time '24:00'"):
+            parse_time("24:00")
+
+    def test_times_are_parsed_once_per_event(self):
+        output_file = "test_output.ics"
+        event = {"summary": "Training", "dates": ["0%d.01.2023" % day for day in range(1, 10)],
+                 "start_time": "17:00", "end_time": "18:30"}
+        parse_time.cache_clear()
+        try:
+            create_ics([event], output_file)
+        finally:
+            os.remove(output_file)
+        info = parse_time.cache_info()
+        self.assertEqual(info.hits + info.misses, 2)
+
+    def test_invalid_date_in_event(self):
+        with self.assertRaisesRegex(ValueError, "Invalid date '32.01.2023'"):
+            create_ics([{"summary": "Broken", "date": "32.01.2023"}], "test_output.ics")
+
+class TestExceptionIndex(unittest.TestCase):
+
+    def test_overlapping_ranges_are_merged(self):
+        index = ExceptionIndex([
+            (date(2023, 1, 2), date(2023, 1, 5)),
+            (date(2023, 1, 4), date(2023, 1, 8)),
+            (date(2023, 1, 3), date(2023, 1, 4)),
+        ])
+        self.assertEqual(len(index.starts), 1)
+        self.assertEqual(len(index), 7)
+        self.assertEqual(list(index.dates_between()), [date(2023, 1, day) for day in range(2, 9)])
+
+    def test_adjacent_ranges_are_merged(self):
+        index = ExceptionIndex([
+            (date(2023, 1, 6), date(2023, 1, 7)),
+            (date(2023, 1, 2), date(2023, 1, 5)),
+        ])
+        self.assertEqual(len(index.starts), 1)
+        self.assertEqual(list(index.dates_between()), [date(2023, 1, day) for day in range(2, 8)])
+
+    def test_separate_ranges_are_kept(self):
+        index = ExceptionIndex([
+            (date(2023, 1, 2), date(2023, 1, 3)),
+            (date(2023, 1, 5), date(2023, 1, 5)),
+        ])
+        self.assertEqual(len(index.starts), 2)
+        self.assertIn(date(2023, 1, 3), index)
+        self.assertNotIn(date(2023, 1, 4), index)
+        self.assertIn(date(2023, 1, 5), index)
+        self.assertNotIn(date(2023, 1, 1), index)
+        self.assertNotIn(date(2023, 1, 6), index)
+
+    def test_range_queries(self):
+        index = ExceptionIndex([
+            (date(2023, 1, 2), date(2023, 1, 4)),
+            (date(2023, 1, 10), date(2023, 1, 12)),
+            (date(2023, 2, 1), date(2023, 2, 1)),
+        ])
+        self.assertEqual(list(index.dates_between(date(2023, 1, 3), date(2023, 1, 11))),
+                         [date(2023, 1, 3), date(2023, 1, 4), date(2023, 1, 10), date(2023, 1, 11)])
+        self.assertEqual(list(index.dates_between(date(2023, 1, 5), date(2023, 1, 9))), [])
+        self.assertEqual(list(index.dates_between(date(2023, 1, 12))), [date(2023, 1, 12), date(2023, 2, 1)])
+        self.assertEqual(list(index.dates_between(None, date(2023, 1, 2))), [date(2023, 1, 2)])
+
+    def test_empty_index(self):
+        index = ExceptionIndex.from_exceptions([])
+        self.assertFalse(index)
+        self.assertNotIn(date(2023, 1, 1), index)
+        self.assertEqual(list(index.dates_between(date(2023, 1, 1))), [])
+
+    def test_overlapping_exceptions_in_output(self):
+        output_file = "test_output.ics"
+        event = {"summary": "Multi Day Event", "date_start": "01.01.2023", "date_end": "10.01.2023"}
+        exceptions = [
+            {"date_start": "02.01.2023", "date_end": "05.01.2023"},
+            {"date_start": "04.01.2023", "date_end": "06.01.2023"},
+            {"date_start": "07.01.2023", "date_end": "07.01.2023"},
+            {"date_start": "15.01.2023", "date_end": "15.01.2023"},
+        ]
+        try:
+            create_ics([event], output_file, exceptions)
+            with open(output_file, 'rb') as f:
+                ical_content = f.read().decode()
+        finally:
+            os.remove(output_file)
+        # Every exception day inside the event appears exactly once, in ascending order
+        self.assertIn("EXDATE;VALUE=DATE:20230102,20230103,20230104,20230105,20230106,20230107\r\n", ical_content)
+
+class TestPrunedExdates(unittest.TestCase):
+
+    def setUp(self):
+        self.output_file = "test_output.ics"
+
+    def tearDown(self):
+        if os.path.exists(self.output_file):
+            os.remove(self.output_file)
+
+    def exdates_for(self, event, exceptions, prune_exdates=True):
+        create_ics([event], self.output_file, exceptions, prune_exdates=prune_exdates)
+        with open(self.output_file, 'rb') as f:
+            cal = Calendar.from_ical(f.read())
+        for component in cal.walk("VEVENT"):
+            exdate = component.get("EXDATE")
+            return [dt.dt.strftime("%Y%m%d") for dt in exdate.dts] if exdate else []
+
+    def test_biweekly_only_gets_matching_exdates(self):
+        event = {
+            "summary": "Biweekly",
+            "date": "02.01.2023",  # Monday
+            "recurrence": {"freq": "WEEKLY", "interval": 2, "until": "31.12.2023"}
+        }
+        exceptions = [
+            {"date_start": "09.01.2023", "date_end": "20.01.2023"},  # hits 16.01 only
+            {"date_start": "01.07.2023", "date_end": "31.08.2023"},  # summer break
+        ]
+        self.assertEqual(self.exdates_for(event, exceptions),
+                         ["20230116", "20230703", "20230717", "20230731", "20230814", "20230828"])
+        # Without pruning every exception day after the start date is listed
+        self.assertEqual(len(self.exdates_for(event, exceptions, prune_exdates=False)), 12 + 62)
+
+    def test_exdates_respect_until_and_count(self):
+        exceptions = [{"date_start": "01.01.2023", "date_end": "31.12.2023"}]
+        until_event = {"summary": "Until", "date": "01.01.2023",
+                       "recurrence": {"freq": "DAILY", "interval": 3, "until": "10.01.2023"}}
+        self.assertEqual(self.exdates_for(until_event, exceptions),
+                         ["20230101", "20230104", "20230107", "20230110"])
+        count_event = {"summary": "Count", "date": "01.01.2023",
+                       "recurrence": {"freq": "MONTHLY", "interval": 1, "count": 3}}
+        self.assertEqual(self.exdates_for(count_event, exceptions), ["20230101", "20230201", "20230301"])
+
+    def test_timed_exdates_keep_start_time(self):
+        event = {"summary": "Timed", "date": "02.01.2023", "start_time": "08:00", "end_time": "09:00",
+                 "recurrence": {"freq": "WEEKLY", "interval": 1}}
+        exceptions = [{"date_start": "05.01.2023", "date_end": "10.01.2023"}]
+        create_ics([event], self.output_file, exceptions, prune_exdates=True)
+        with open(self.output_file, 'rb') as f:
+            self.assertIn("EXDATE:20230109T080000\r\n", f.read().decode())
+
+    def test_no_exceptions_after_start(self):
+        event = {"summary": "Late", "date": "01.02.2023", "recurrence": {"freq": "DAILY", "interval": 1}}
+        exceptions = [{"date_start": "01.01.2023", "date_end": "31.01.2023"}]
+        self.assertEqual(self.exdates_for(event, exceptions), [])
+
+    def test_unbounded_rule_falls_back_after_expansion_cap(self):
+        exception_dates = ExceptionIndex.from_exceptions([{"date_start": "01.01.2023", "date_end": "10.01.2023"}])
+        recurrence = {"freq": "DAILY", "interval": 2}
+        original_cap = generate_ics.MAX_EXPANDED_OCCURRENCES
+        generate_ics.MAX_EXPANDED_OCCURRENCES = 2
+        try:
+            exdates = rrule_exdates(date(2023, 1, 1), recurrence_rrule(recurrence), exception_dates)
+        finally:
+            generate_ics.MAX_EXPANDED_OCCURRENCES = original_cap
+        # Occurrences 01.01 and 03.01 are expanded, then every remaining exception day is kept
+        self.assertEqual(exdates, [date(2023, 1, 1), date(2023, 1, 3)] + [date(2023, 1, day) for day in range(4, 11)])
+
+class TestStats(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output_file = os.path.join(self.tmp_dir, "output.ics")
+        self.events = [
+            {"summary": "Dates", "dates": ["01.01.2023", "24.12.2023", "27.12.2023"], "start_time": "10:00", "end_time": "11:00"},
+            {"summary": "Weekly", "date": "01.01.2023", "recurrence": {"freq": "WEEKLY", "interval": 1, "count": 60}},
+            {"summary": "Camp", "date_start": "20.12.2023", "date_end": "28.12.2023"},
+            {"summary": "Single", "date": "25.12.2023"},
+        ]
+        self.exceptions = [{"date_start": "24.12.2023", "date_end": "26.12.2023"}]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def run_stats(self, **options):
+        stats = Stats()
+        create_ics(self.events, self.output_file, self.exceptions, stats=stats, **options)
+        return stats
+
+    def test_counters(self):
+        stats = self.run_stats()
+        self.assertEqual(stats.counters, {
+            "events_dates": 1, "events_recurrence": 1, "events_multi_day": 1, "events_single_day": 1,
+            "exception_days": 3, "vevents": 4, "occurrences": 4, "occurrences_skipped": 2, "exdates": 6,
+            "bytes_written": os.path.getsize(self.output_file),
+        })
+        self.assertEqual(set(stats.timings), {"load", "exceptions", "build", "serialize", "write"})
+
+    def test_counters_match_across_modes(self):
+        expected = self.run_stats().counters
+        for options in [{"streaming": True}, {"serializer": "native"}, {"workers": 2}]:
+            self.assertEqual(self.run_stats(**options).counters, expected)
+        # Cold and warm cache runs, the warm ones taking every event from the cache
+        cache_file = os.path.join(self.tmp_dir, "events.cache")
+        for workers, hits in [(1, 0), (1, 4), (2, 4)]:
+            counters = self.run_stats(cache=VEventCache(cache_file), workers=workers).counters
+            self.assertEqual((counters.pop("cache_hits"), counters.pop("cache_misses")), (hits, 4 - hits))
+            self.assertEqual(counters, expected)
+        compact = self.run_stats(compact_dates=True).counters
+        self.assertEqual((compact["vevents"], compact["occurrences"], compact["occurrences_skipped"]), (3, 4, 2))
+
+    def test_stats_do_not_change_output(self):
+        create_ics(self.events, self.output_file, self.exceptions)
+        with open(self.output_file, "rb") as f:
+            expected = f.read()
+        self.run_stats()
+        with open(self.output_file, "rb") as f:
+            self.assertEqual(f.read(), expected)
+
+    def test_nested_stages_are_exclusive(self):
+        stats = Stats()
+        with stats.stage("outer"):
+            with stats.stage("inner"):
+                sum(range(100000))
+        self.assertLess(stats.timings["outer"], stats.timings["inner"])
+        items = list(stats.iterate("produce", iter([1, 2, 3])))
+        self.assertEqual(items, [1, 2, 3])
+        self.assertIn("produce", stats.timings)
+
+    def test_main_stats_and_profile(self):
+        input_file = os.path.join(self.tmp_dir, "events.json")
+        with open(input_file, "w") as f:
+            json.dump({"events": self.events, "exceptions": self.exceptions}, f)
+        stats_file = os.path.join(self.tmp_dir, "stats.json")
+        profile_file = os.path.join(self.tmp_dir, "run.prof")
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            main([input_file, self.output_file, "--no-cache", "--stats", stats_file, "--profile", profile_file])
+            main([input_file, self.output_file, "--no-cache", "--stats"])
+        with open(stats_file) as f:
+            report = json.load(f)
+        self.assertEqual(report["counters"]["vevents"], 4)
+        self.assertGreater(report["timings"]["load"], 0)
+        self.assertTrue(os.path.getsize(profile_file) > 0)
+        self.assertIn("Stage timings:", output.getvalue())
+        self.assertIn("occurrences_skipped", output.getvalue())
+
+class TestCheck(unittest.TestCase):
+
+    def test_valid_input(self):
+        events = [
+            {"summary": "Single", "date": "01.01.2023", "start_time": "10:00", "end_time": "11:00"},
+            {"summary": "Dates", "dates": ["01.01.2023", "02.01.2023"]},
+            {"summary": "Overnight", "date_start": "01.01.2023", "date_end": "02.01.2023", "start_time": "22:00", "end_time": "06:00"},
+            {"summary": "Weekly", "date": "01.01.2023", "recurrence": {"freq": "weekly", "interval": 2, "count": 5, "until": "01.06.2023"}},
+            # interval defaults to 1
+            {"summary": "Monthly", "date": "31.01.2023", "recurrence": {"freq": "MONTHLY"}},
+        ]
+        self.assertEqual(check_input(events, [{"date_start": "24.12.2023", "date_end": "26.12.2023"}]), [])
+
+    def test_problems(self):
+        events = [
+            {"summary": "A", "dates": ["01.01.2023", "32.01.2023"], "start_time": "12:00", "end_time": "11:00"},
+            {"summary": "B", "date": "01.01.2023", "recurrence": {"freq": "FORTNIGHTLY", "interval": 0, "count": 0, "until": "01.12.2022"}},
+            {"summary": "C", "date_start": "28.12.2023", "date_end": "20.12.2023", "start_time": "10:00"},
+            {"date": "24.12.2023"},
+            {"summary": "E"},
+        ]
+        exceptions = [{"date_start": "26.12.2023", "date_end": "24.12.2023"}, {"date_start": "1.1.2023"}]
+        self.assertEqual(check_input(iter(events), exceptions), [
+            "exception 1: date_start 26.12.2023 is after date_end 24.12.2023",
+            "exception 2: date_end is missing",
+            "event 1 (A): dates[1]: Invalid date '32.01.2023': day is out of range for month",
+            "event 1 (A): start_time 12:00 is after end_time 11:00",
+            "event 2 (B): recurrence.freq: expected one of SECONDLY, MINUTELY, HOURLY, DAILY, WEEKLY, MONTHLY, YEARLY, got 'FORTNIGHTLY'",
+            "event 2 (B): recurrence.interval: expected a positive integer, got 0",
+            "event 2 (B): recurrence.count: expected a positive integer, got 0",
+            "event 2 (B): recurrence.until 01.12.2022 is before date 01.01.2023",
+            "event 3 (C): date_start 28.12.2023 is after date_end 20.12.2023",
+            "event 3 (C): start_time and end_time have to be given together",
+            "event 4: summary is missing",
+            "event 5 (E): no date: expected date, dates, or date_start and date_end",
+        ])
+
+    def test_main_check(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_file = os.path.join(tmp_dir, "events.json")
+            with open(input_file, "w") as f:
+                json.dump([{"summary": "Fine", "date": "01.01.2023"}], f)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                self.assertEqual(main([input_file, "--check"]), 0)
+                with open(input_file, "w") as f:
+                    json.dump([{"summary": "Broken", "date": "01.13.2023"}], f)
+                self.assertEqual(main([input_file, "--check"]), 1)
+                self.assertEqual(main([os.path.join(tmp_dir, "missing.json"), "--check"]), 1)
+            self.assertEqual(output.getvalue().splitlines()[:3], [
+                f"{input_file}: OK",
+                "event 1 (Broken): date: Invalid date '01.13.2023': month must be in 1..12",
+                f"{input_file}: 1 problem found",
+            ])
+            self.assertEqual(os.listdir(tmp_dir), ["events.json"])
+
+    def test_main_check_ignores_output_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_file = os.path.join(tmp_dir, "events.json")
+            output_file = os.path.join(tmp_dir, "events.ics")
+            with open(input_file, "w") as f:
+                json.dump([{"summary": "Fine", "date": "01.01.2023"}], f)
+            with open(output_file, "w") as f:
+                f.write("BEGIN:VCALENDAR\nEND:VCALENDAR\n")
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                self.assertEqual(main([input_file, output_file, "--check"]), 0)
+            self.assertEqual(output.getvalue(), f"{input_file}: OK\n")
+
+    def test_main_exit_status(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_file = os.path.join(tmp_dir, "events.json")
+            output_file = os.path.join(tmp_dir, "events.ics")
+            with open(input_file, "w") as f:
+                json.dump([{"summary": "Broken", "date": "32.01.2023"}], f)
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                self.assertEqual(main([input_file, output_file, "--no-cache"]), 1)
+                self.assertEqual(main([os.path.join(tmp_dir, "missing.json"), output_file, "--no-cache"]), 1)
+                with open(input_file, "w") as f:
+                    json.dump([{"summary": "Fine", "date": "31.01.2023"}], f)
+                self.assertEqual(main([input_file, output_file, "--no-cache"]), 0)
+            self.assertIn("Error: Invalid date '32.01.2023'", output.getvalue())
+            self.assertIn("not found", output.getvalue())
+            result = subprocess.run([sys.executable, "generate_ics.py", os.path.join(tmp_dir, "missing.json"), output_file],
+                                    capture_output=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            self.assertEqual(result.returncode, 1)
+
+    def test_check_does_not_import_serializer(self):
+        # Run in a fresh interpreter, where nothing has imported icalendar yet
+        code = ("import sys, generate_ics; generate_ics.main(['--check', sys.argv[1]]); "
+                "print(sorted(m for m in ('icalendar', 'dateutil') if m in sys.modules))")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_file = os.path.join(tmp_dir, "events.json")
+            with open(input_file, "w") as f:
+                json.dump([{"summary": "Weekly", "date": "01.01.2023", "recurrence": {"freq": "WEEKLY", "interval": 1}}], f)
+            result = subprocess.run([sys.executable, "-c", code, input_file], capture_output=True, text=True, check=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.stdout.splitlines()[-1], "[]")
+
+class TestServe(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.input_file = os.path.join(self.tmp_dir, "club.json")
+        self.events = [{"summary": "Club", "date": "01.01.2023", "recurrence": {"freq": "WEEKLY", "interval": 1}}]
+        self.exceptions = [{"date_start": "24.12.2023", "date_end": "26.12.2023"}]
+        self.write_input(self.events)
+        self.service = CalendarService({"club": self.input_file}, options={"serializer": "native"})
+        # Port 0 picks a free port on localhost
+        self.server = make_server(self.service, "127.0.0.1", 0, quiet=True)
+        self.base_url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.tmp_dir)
+
+    def write_input(self, events):
+        with open(self.input_file, "w") as f:
+            json.dump({"events": events, "exceptions": self.exceptions}, f)
+
+    def request(self, path, data=None, headers={}):
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers)
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, e.read()
+
+    def expected(self, events):
+        output_file = os.path.join(self.tmp_dir, "expected.ics")
+        create_ics(events, output_file, self.exceptions, serializer="native")
+        with open(output_file, "rb") as f:
+            return f.read()
+
+    def test_post_payload(self):
+        payload = json.dumps({"events": self.events, "exceptions": self.exceptions}).encode("utf-8")
+        status, headers, body = self.request("/calendar", payload)
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["Content-Type"], "text/calendar; charset=utf-8")
+        self.assertEqual(body, self.expected(self.events))
+        self.assertEqual(self.request("/calendar", payload)[2], body)
+        self.assertEqual((self.service.hits, self.service.misses), (1, 1))
+
+    def test_registered_file_and_etag(self):
+        status, headers, body = self.request("/calendars/club.ics")
+        self.assertEqual(status, 200)
+        self.assertEqual(body, self.expected(self.events))
+        etag = headers["ETag"]
+        status, headers, body = self.request("/calendars/club.ics", headers={"If-None-Match": etag})
+        self.assertEqual((status, headers["ETag"], body), (304, etag, b""))
+
+        # Editing the file changes the calendar and its ETag
+        events = [dict(self.events[0], summary="Chess club")]
+        self.write_input(events)
+        status, headers, body = self.request("/calendars/club.ics", headers={"If-None-Match": etag})
+        self.assertEqual(status, 200)
+        self.assertNotEqual(headers["ETag"], etag)
+        self.assertEqual(body, self.expected(events))
+
+    def test_errors(self):
+        self.assertEqual(self.request("/calendars/nope.ics")[0], 404)
+        self.assertEqual(self.request("/elsewhere")[0], 404)
+        self.assertEqual(self.request("/calendar", b"{not json")[0], 400)
+        status, _, body = self.request("/calendar", b'[{"summary": "Bad", "date": "32.01.2023"}]')
+        self.assertEqual(status, 400)
+        self.assertIn(b"event 1 (Bad): date: Invalid date '32.01.2023'", body)
+
+    def test_lru_cache(self):
+        service = CalendarService(cache_size=2)
+        payloads = [json.dumps([{"summary": f"Event {i}", "date": "01.01.2023"}]).encode("utf-8") for i in range(3)]
+        for payload in payloads + payloads[2:] + payloads[:1]:
+            self.assertEqual(service.handle("POST", "/calendar", {}, payload)[0], 200)
+        # The third payload pushed out the first, which had to be rendered again
+        self.assertEqual((service.hits, service.misses), (1, 4))
+        self.assertEqual(len(service.rendered), 2)
+
+class TestMerge(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_merge_inputs(self):
+        holidays = {"date_start": "24.12.2023", "date_end": "26.12.2023"}
+        school = ([{"summary": "Exam", "date": "10.01.2023"}, {"summary": "Trip", "date": "12.01.2023"}], [holidays])
+        club = (iter([{"date": "10.01.2023", "summary": "Exam"}, {"summary": "Training", "date": "11.01.2023"},
+                      {"summary": "Exam", "date": "10.01.2023", "description": "Maths"}]),
+                [dict(holidays, name="Christmas"), {"date_start": "01.08.2023", "date_end": "02.08.2023"}])
+        events, exceptions, report = merge_inputs([school, club])
+        self.assertEqual(exceptions, [holidays, {"date_start": "01.08.2023", "date_end": "02.08.2023"}])
+        self.assertEqual([(event["summary"], event.get("description")) for event in events],
+                         [("Exam", None), ("Trip", None), ("Training", None), ("Exam", "Maths")])
+        self.assertEqual((report.events, report.duplicate_events, report.exceptions, report.duplicate_exceptions), (4, 1, 2, 1))
+        self.assertEqual(str(report), "Merged 2 input files: 4 events (1 duplicates dropped), 2 exceptions (1 duplicates dropped)")
+
+    def test_main_merges_input_files(self):
+        first = os.path.join(self.tmp_dir, "first.json")
+        second = os.path.join(self.tmp_dir, "second.py")
+        output_file = os.path.join(self.tmp_dir, "merged.ics")
+        with open(first, "w") as f:
+            json.dump([{"summary": "Shared", "date": "01.01.2023"}, {"summary": "First", "date": "02.01.2023"}], f)
+        with open(second, "w") as f:
+            f.write("events = [{'summary': 'Second', 'date': '03.01.2023'}, {'summary': 'Shared', 'date': '01.01.2023'}]")
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            main([first, second, output_file, "--no-cache"])
+        self.assertIn("Merged 2 input files: 3 events (1 duplicates dropped)", output.getvalue())
+        with open(output_file, "rb") as f:
+            cal = Calendar.from_ical(f.read())
+        self.assertEqual([str(event["summary"]) for event in cal.walk("VEVENT")], ["Shared", "First", "Second"])
+
+class TestVectorizedDates(unittest.TestCase):
+
+    def setUp(self):
+        self.original_min_dates = generate_ics.VECTORIZE_MIN_DATES
+        self.original_numpy_module = generate_ics.numpy_module
+        self.dates = ["%02d.%02d.%d" % (day, month, year) for year in (2023, 2024) for month in range(1, 13) for day in range(1, 29, 3)]
+        self.dates += ["29.02.2024", "31.12.2023", "01.01.2023", "15.06.2023"]
+        self.exceptions = ExceptionIndex.from_exceptions([
+            {"date_start": "24.12.2023", "date_end": "06.01.2024"},
+            {"date_start": "01.01.2023", "date_end": "01.01.2023"},
+            {"date_start": "10.06.2023", "date_end": "20.06.2023"},
+        ])
+
+    def tearDown(self):
+        generate_ics.VECTORIZE_MIN_DATES = self.original_min_dates
+        generate_ics.numpy_module = self.original_numpy_module
+
+    def python_filter(self, dates, unique=False):
+        generate_ics.numpy_module = lambda: None
+        try:
+            return drop_exception_days(parse_dates(dates), self.exceptions, unique)
+        finally:
+            generate_ics.numpy_module = self.original_numpy_module
+
+    def test_python_fallback(self):
+        kept, skipped = self.python_filter(["01.01.2023", "02.01.2023", "24.12.2023", "02.01.2023"])
+        self.assertEqual((kept, skipped), ([date(2023, 1, 2), date(2023, 1, 2)], 2))
+        self.assertEqual(self.python_filter(["02.01.2023", "01.01.2023", "02.01.2023"], unique=True), ([date(2023, 1, 2)], 1))
+
+    @unittest.skipUnless(numpy_module(), "NumPy is not installed")
+    def test_vectorized_matches_python(self):
+        generate_ics.VECTORIZE_MIN_DATES = 1
+        for unique in (False, True):
+            expected = self.python_filter(self.dates, unique)
+            kept, skipped = drop_exception_days(parse_dates(self.dates), self.exceptions, unique)
+            self.assertEqual((kept, skipped), expected)
+            self.assertTrue(all(type(day) is date for day in kept))
+        self.assertEqual(drop_exception_days(parse_dates(self.dates), ExceptionIndex()), ([parse_date(value) for value in self.dates], 0))
+
+    @unittest.skipUnless(numpy_module(), "NumPy is not installed")
+    def test_vectorized_falls_back_on_unusual_dates(self):
+        generate_ics.VECTORIZE_MIN_DATES = 1
+        # Single-digit days are valid but not in the strict form the bulk parser handles
+        self.assertEqual(parse_dates(["1.2.2023", "02.02.2023"]), [date(2023, 2, 1), date(2023, 2, 2)])
+        for invalid in ["31.02.2023", "29.02.2023", "01.13.2023", "01-01-2023", "01.01.20234"]:
+            with self.assertRaisesRegex(ValueError, "Invalid date"):
+                parse_dates(["01.01.2023", invalid])
+
+    @unittest.skipUnless(numpy_module(), "NumPy is not installed")
+    def test_create_ics_output_unchanged(self):
+        events = [{"summary": "Training", "dates": self.dates, "start_time": "17:00", "end_time": "18:30"}]
+        exceptions = [{"date_start": "24.12.2023", "date_end": "06.01.2024"}]
+        outputs = []
+        for min_dates in (1, 10 ** 9):
+            generate_ics.VECTORIZE_MIN_DATES = min_dates
+            for compact_dates in (False, True):
+                buffer = io.BytesIO()
+                create_ics(events, buffer, exceptions, serializer="native", compact_dates=compact_dates)
+                outputs.append(buffer.getvalue())
+        self.assertEqual(outputs[:2], outputs[2:])
+
+class TestOccurrences(unittest.TestCase):
+
+    def setUp(self):
+        self.events = [
+            {"summary": "Dates", "dates": ["01.01.2023", "02.01.2023", "25.12.2023"], "start_time": "10:00", "end_time": "11:00"},
+            {"summary": "Weekly", "date": "02.01.2023", "recurrence": {"freq": "WEEKLY", "interval": 1, "count": 60}},
+            {"summary": "Monthly", "date": "31.01.2023", "recurrence": {"freq": "MONTHLY", "interval": 1}},
+            {"summary": "Camp", "date_start": "20.12.2023", "date_end": "28.12.2023"},
+            {"summary": "Holiday camp", "date_start": "24.12.2023", "date_end": "30.12.2023"},
+            {"summary": "Single", "date": "24.12.2023"},
+            {"summary": "Overnight", "date_start": "30.12.2023", "date_end": "02.01.2024", "start_time": "22:00", "end_time": "06:00"},
+        ]
+        self.exceptions = [{"date_start": "24.12.2023", "date_end": "26.12.2023"}]
+        self.index = OccurrenceIndex(self.events, self.exceptions)
+
+    def summaries(self, occurrences):
+        return [(occurrence.start, occurrence.summary) for occurrence in occurrences]
+
+    def test_window(self):
+        self.assertEqual(self.summaries(self.index.between(date(2023, 12, 18), date(2024, 1, 3))), [
+            (date(2023, 12, 18), "Weekly"),
+            (date(2023, 12, 20), "Camp"),
+            (datetime(2023, 12, 30, 22, 0), "Overnight"),
+            (date(2023, 12, 31), "Monthly"),
+            (date(2024, 1, 1), "Weekly"),
+        ])
+
+    def test_on(self):
+        # Camp started before the day and is still running; Monthly skips months without a 31st
+        self.assertEqual(self.summaries(self.index.on(date(2023, 12, 27))), [(date(2023, 12, 20), "Camp")])
+        self.assertEqual(self.summaries(self.index.on(date(2023, 1, 2))),
+                         [(date(2023, 1, 2), "Weekly"), (datetime(2023, 1, 2, 10, 0), "Dates")])
+        monthly = [o.start for o in self.index.between(date(2023, 2, 1), date(2023, 6, 30)) if o.summary == "Monthly"]
+        self.assertEqual(monthly, [date(2023, 3, 31), date(2023, 5, 31)])
+        occurrence = next(iter(self.index.on(date(2024, 1, 2))))
+        self.assertEqual((occurrence.summary, occurrence.end), ("Overnight", datetime(2024, 1, 2, 6, 0)))
+
+    def test_matches_full_expansion(self):
+        # Without the open-ended rule, every window must return exactly the matching part of everything
+        index = OccurrenceIndex([event for event in self.events if event["summary"] != "Monthly"], self.exceptions)
+        everything = list(index.between(date(2000, 1, 1), date(2100, 1, 1)))
+        self.assertEqual(len(everything), (3 - 1) + (60 - 1) + 1 + 1)
+        for offset in range(0, 400, 7):
+            first = date(2023, 1, 1) + timedelta(days=offset)
+            last = first + timedelta(days=offset % 11)
+
+            def overlaps(occurrence):
+                start = occurrence.start if not isinstance(occurrence.start, datetime) else occurrence.start.date()
+                end = occurrence.end - timedelta(days=1) if not isinstance(occurrence.end, datetime) else occurrence.end.date()
+                return start <= last and end >= first
+
+            self.assertEqual(list(index.between(first, last)), [o for o in everything if overlaps(o)])
+
+    def test_recurrence_starts_match_dateutil(self):
+        from dateutil import rrule as dateutil_rrule
+        for freq, interval, count, until, start in [
+            ("DAILY", 1, None, date(2023, 3, 1), datetime(2023, 1, 3, 9, 30)),
+            ("WEEKLY", 2, 10, None, datetime(2023, 1, 3, 9, 30)),
+            ("daily", 3, 20, None, datetime(2023, 1, 3, 9, 30)),
+            ("WEEKLY", 1, None, date(2023, 2, 5), datetime(2023, 1, 3, 9, 30)),
+            # Months and years without the start's day are skipped
+            ("MONTHLY", 1, 12, None, datetime(2023, 1, 31, 9, 30)),
+            ("MONTHLY", 5, None, date(2026, 1, 1), datetime(2023, 1, 31, 9, 30)),
+            ("monthly", 2, None, date(2024, 7, 1), datetime(2023, 1, 3, 9, 30)),
+            ("YEARLY", 1, 3, None, datetime(2020, 2, 29, 9, 30)),
+            ("YEARLY", 2, None, date(2031, 1, 1), datetime(2020, 2, 29, 9, 30)),
+        ]:
+            rrule = {"FREQ": freq, "INTERVAL": interval}
+            if count:
+                rrule["COUNT"] = count
+            if until:
+                rrule["UNTIL"] = until
+            data = VEventData("Rule", None, start, start + timedelta(hours=1), rrule, None)
+            expected = list(dateutil_rrule.rrule(getattr(dateutil_rrule, freq.upper()), dtstart=start, interval=interval, count=count,
+                                                 until=datetime.combine(until, time.max) if until else None))
+            # Exact with COUNT; with UNTIL only, UNTIL itself bounds the last instance
+            self.assertEqual(generate_ics.recurrence_last_start(data), expected[-1].toordinal() if count else until.toordinal())
+            for first in (date(2019, 1, 1), date(2022, 12, 1), date(2023, 1, 10), date(2023, 1, 31), date(2024, 3, 1)):
+                self.assertEqual(list(recurrence_starts(data, first)), [d for d in expected if d.date() >= first])
+
+    def test_finished_rules_are_skipped(self):
+        events = [{"summary": f"Term {year}", "date": f"05.09.{year}", "recurrence": {"freq": "MONTHLY", "interval": 1, "count": 10}}
+                  for year in range(2000, 2030)]
+        events.append({"summary": "Forever", "date": "01.01.2000", "recurrence": {"freq": "YEARLY", "interval": 1}})
+        index = OccurrenceIndex(events)
+        self.assertEqual([data.summary for data in index.rules_between(date(2023, 1, 1).toordinal(), date(2023, 1, 31).toordinal())],
+                         ["Forever", "Term 2022"])
+        self.assertEqual([data.summary for data in index.rules_between(date(2010, 6, 1).toordinal(), date(2010, 9, 30).toordinal())],
+                         ["Forever", "Term 2009", "Term 2010"])
+        self.assertEqual(self.summaries(index.between(date(2023, 6, 1), date(2023, 9, 30))),
+                         [(date(2023, 6, 5), "Term 2022"), (date(2023, 9, 5), "Term 2023")])
+        self.assertEqual(self.summaries(index.on(date(2029, 1, 1))), [(date(2029, 1, 1), "Forever")])
+
+    def test_query_command(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_file = os.path.join(tmp_dir, "events.json")
+            with open(input_file, "w") as f:
+                json.dump({"events": self.events, "exceptions": self.exceptions}, f)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                self.assertEqual(main(["query", input_file, "--from", "27.12.2023", "--to", "31.12.2023"]), 0)
+                self.assertEqual(main(["query", input_file, "--from", "02.01.2023", "--json"]), 0)
+        text, _, json_output = output.getvalue().partition("[")
+        self.assertEqual(text.splitlines(), [
+            "20.12.2023 - 28.12.2023  Camp",
+            "30.12.2023 22:00 - 02.01.2024 06:00  Overnight",
+            "31.12.2023  Monthly",
+        ])
+        self.assertEqual([(o["start"], o["all_day"], o["summary"]) for o in json.loads("[" + json_output)],
+                         [("2023-01-02", True, "Weekly"), ("2023-01-02T10:00:00", False, "Dates")])
+
+class TestNormalizedEvents(unittest.TestCase):
+
+    def test_shapes(self):
+        single = normalize_event({"summary": "Single", "description": "Notes", "date": "24.12.2023", "start_time": "10:00", "end_time": "11:30"})
+        self.assertEqual((single.shape, single.start, single.end, single.start_time, single.end_time, single.description),
+                         ("single_day", date(2023, 12, 24), date(2023, 12, 24), time(10, 0), time(11, 30), "Notes"))
+        multi = normalize_event({"summary": "Camp", "date_start": "20.12.2023", "date_end": "28.12.2023", "start_time": "10:00"})
+        # A start time without an end time is ignored, as it always has been
+        self.assertEqual((multi.shape, multi.start, multi.end, multi.start_time), ("multi_day", date(2023, 12, 20), date(2023, 12, 28), None))
+        dates = normalize_event({"summary": "Dates", "dates": ["02.01.2023", "01.01.2023"]})
+        self.assertEqual((dates.shape, dates.start, dates.dates), ("dates", None, [date(2023, 1, 2), date(2023, 1, 1)]))
+        weekly = normalize_event({"summary": "Weekly", "date": "02.01.2023", "recurrence": {"freq": "WEEKLY", "until": "31.03.2023"}})
+        self.assertEqual(weekly.rrule, {"FREQ": "WEEKLY", "INTERVAL": 1, "UNTIL": date(2023, 3, 31)})
+        self.assertIs(normalize_event(weekly), weekly)
+
+    def test_same_vevents(self):
+        exception_dates = ExceptionIndex.from_exceptions([{"date_start": "24.12.2023", "date_end": "26.12.2023"}])
+        events = [
+            {"summary": "Dates", "dates": ["25.12.2023", "27.12.2023"], "start_time": "10:00", "end_time": "11:00"},
+            {"summary": "Weekly", "date": "18.12.2023", "recurrence": {"freq": "WEEKLY", "interval": 1, "count": 4}},
+            {"summary": "Camp", "date_start": "20.12.2023", "date_end": "28.12.2023"},
+            {"summary": "Single", "date": "24.12.2023"},
+        ]
+        for event in events:
+            for prune, compact in [(False, False), (True, True)]:
+                self.assertEqual(list(event_vevent_data(normalize_event(event), exception_dates, prune, compact)),
+                                 list(event_vevent_data(event, exception_dates, prune, compact)))
+        self.assertEqual(list(event_vevent_data(events[3], exception_dates)), [])
+
+
+class TestAtomicOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output_file = os.path.join(self.tmp_dir, "output.ics")
+        self.events = [{"summary": "Single", "date": "24.12.2023"}, {"summary": "Dates", "dates": ["01.01.2023", "02.01.2023"]}]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_unchanged_output_is_not_rewritten(self):
+        self.assertTrue(create_ics(self.events, self.output_file, serializer="native"))
+        os.utime(self.output_file, (1000000000, 1000000000))
+        self.assertFalse(create_ics(self.events, self.output_file))
+        self.assertEqual(os.path.getmtime(self.output_file), 1000000000)
+        self.assertTrue(create_ics(self.events[:1], self.output_file))
+        self.assertNotEqual(os.path.getmtime(self.output_file), 1000000000)
+        self.assertEqual(os.listdir(self.tmp_dir), ["output.ics"])
+
+    def test_failed_write_keeps_old_output(self):
+        create_ics(self.events, self.output_file)
+        content = self.read(self.output_file)
+        with self.assertRaises(ValueError):
+            create_ics(self.events + [{"summary": "Broken", "date": "31.02.2023"}], self.output_file, streaming=True)
+        self.assertEqual(self.read(self.output_file), content)
+        self.assertEqual(os.listdir(self.tmp_dir), ["output.ics"])
+
+    def test_gzip_and_digest(self):
+        import gzip, hashlib
+        create_ics(self.events, self.output_file, gzip_output=True, digest_file=True)
+        content = self.read(self.output_file)
+        compressed = self.read(self.output_file + ".gz")
+        self.assertEqual(gzip.decompress(compressed), content)
+        self.assertEqual(self.read(self.output_file + ".sha256").decode("ascii"),
+                         f"{hashlib.sha256(content).hexdigest()}  output.ics\n")
+        # Same content, same bytes: the .gz copy has no timestamp or file name to change
+        os.remove(self.output_file + ".gz")
+        self.assertFalse(create_ics(self.events, self.output_file, gzip_output=True, digest_file=True))
+        self.assertEqual(self.read(self.output_file + ".gz"), compressed)
+
+    def test_file_objects_are_written_as_they_are(self):
+        buffer = io.BytesIO()
+        self.assertTrue(create_ics(self.events, buffer, gzip_output=True, digest_file=True))
+        self.assertTrue(buffer.getvalue().startswith(b"BEGIN:VCALENDAR"))
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+
+class TestShards(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output_file = os.path.join(self.tmp_dir, "calendar.ics")
+        self.events = [
+            {"summary": "Dates", "dates": ["15.12.2023", "05.01.2024", "20.01.2024"], "start_time": "10:00", "end_time": "11:00"},
+            # Crosses into 2024, but stays whole in its start shard
+            {"summary": "Weekly", "date": "04.12.2023", "recurrence": {"freq": "WEEKLY", "interval": 1, "until": "29.02.2024"}},
+            {"summary": "Winter camp", "date_start": "28.12.2023", "date_end": "03.01.2024"},
+            {"summary": "Single", "date": "01.03.2024"},
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def summaries(self, path):
+        with open(path, "rb") as f:
+            cal = Calendar.from_ical(f.read())
+        return sorted(str(component["SUMMARY"]) for component in cal.walk("VEVENT"))
+
+    def index(self):
+        with open(os.path.join(self.tmp_dir, "calendar.index.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def test_by_year(self):
+        self.assertTrue(create_ics(self.events, self.output_file, shard_by="year", serializer="native"))
+        self.assertEqual(self.index(), {"period": "year", "events": 6, "shards": [
+            {"period": "2023", "file": "calendar-2023.ics", "events": 3},
+            {"period": "2024", "file": "calendar-2024.ics", "events": 3},
+        ]})
+        self.assertEqual(self.summaries(os.path.join(self.tmp_dir, "calendar-2023.ics")), ["Dates", "Weekly", "Winter camp"])
+        self.assertEqual(self.summaries(os.path.join(self.tmp_dir, "calendar-2024.ics")), ["Dates", "Dates", "Single"])
+        self.assertFalse(os.path.exists(self.output_file))
+
+    def test_by_month(self):
+        create_ics(self.events, self.output_file, shard_by="month", compact_dates=True)
+        # With RDATEs, all the dates stay in the shard of the first one
+        self.assertEqual([(shard["period"], shard["events"]) for shard in self.index()["shards"]],
+                         [("2023-12", 3), ("2024-03", 1)])
+        self.assertEqual(self.summaries(os.path.join(self.tmp_dir, "calendar-2024-03.ics")), ["Single"])
+
+    def test_same_events_as_one_calendar(self):
+        create_ics(self.events, self.output_file, shard_by="month")
+        shards = [os.path.join(self.tmp_dir, shard["file"]) for shard in self.index()["shards"]]
+        single = os.path.join(self.tmp_dir, "single.ics")
+        create_ics(self.events, single)
+        self.assertEqual(sorted(sum(map(self.summaries, shards), [])), self.summaries(single))
+
+    def read_shards(self):
+        contents = {}
+        for name in sorted(os.listdir(self.tmp_dir)):
+            with open(os.path.join(self.tmp_dir, name), "rb") as f:
+                contents[name] = f.read()
+        return contents
+
+    def test_open_shards_are_capped(self):
+        # Interleaved months, so shards are suspended and resumed over and over
+        events = [{"summary": f"Event {i}", "date": f"{i % 28 + 1:02d}.{i % 12 + 1:02d}.{2020 + i % 3}"} for i in range(300)]
+        create_ics(events, self.output_file, shard_by="month", gzip_output=True, digest_file=True)
+        expected = self.read_shards()
+        shutil.rmtree(self.tmp_dir)
+        os.mkdir(self.tmp_dir)
+        original_max = generate_ics.MAX_OPEN_SHARDS
+        generate_ics.MAX_OPEN_SHARDS = 2
+        try:
+            create_ics(events, self.output_file, shard_by="month", gzip_output=True, digest_file=True)
+        finally:
+            generate_ics.MAX_OPEN_SHARDS = original_max
+        self.assertEqual(len(expected), 12 * 3 + 1)
+        self.assertEqual(self.read_shards(), expected)
+
+    @unittest.skipUnless(sys.platform != "win32", "needs the resource module")
+    def test_more_shards_than_open_file_limit(self):
+        # 400 month shards with .gz copies are 800 files, under a limit of 256 open files
+        code = ("import resource, sys, generate_ics; resource.setrlimit(resource.RLIMIT_NOFILE, (256, 256)); "
+                "events = [{'summary': str(i), 'date': '01.%02d.%d' % (i % 12 + 1, 1900 + i // 12)} for i in range(400)]; "
+                "generate_ics.create_ics(events[::2] + events[1::2], sys.argv[1], shard_by='month', gzip_output=True)")
+        subprocess.run([sys.executable, "-c", code, self.output_file], check=True,
+                       cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(len(self.index()["shards"]), 400)
+        self.assertEqual(len(os.listdir(self.tmp_dir)), 801)
+
+    def test_unchanged_and_errors(self):
+        create_ics(self.events, self.output_file, shard_by="year")
+        self.assertFalse(create_ics(self.events, self.output_file, shard_by="year"))
+        with self.assertRaises(ValueError):
+            create_ics(self.events, self.output_file, shard_by="week")
+        with self.assertRaises(ValueError):
+            create_ics(self.events, self.output_file, shard_by="year", workers=2)
+        with self.assertRaises(ValueError):
+            create_ics(self.events, io.BytesIO(), shard_by="year")
+
+    def test_cli(self):
+        input_file = os.path.join(self.tmp_dir, "events.json")
+        with open(input_file, "w", encoding="utf-8") as f:
+            json.dump({"events": self.events}, f)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            main([input_file, self.output_file, "--shard-by", "year"])
+        self.assertIn("calendar.index.json", output.getvalue())
+        self.assertEqual(len(self.index()["shards"]), 2)
+
+
+class TestConflicts(unittest.TestCase):
+
+    def setUp(self):
+        self.events = [
+            {"summary": "Piano", "date": "02.01.2023", "start_time": "15:00", "end_time": "16:00",
+             "recurrence": {"freq": "WEEKLY", "interval": 1}},
+            {"summary": "Swimming", "dates": ["02.01.2023", "09.01.2023", "16.01.2023"], "start_time": "15:30", "end_time": "16:30"},
+            # Starts when Swimming ends, so no conflict
+            {"summary": "Football", "date": "02.01.2023", "start_time": "16:30", "end_time": "17:00"},
+            {"summary": "Ski camp", "date_start": "18.01.2023", "date_end": "20.01.2023"},
+            {"summary": "Dentist", "date": "19.01.2023", "start_time": "09:00", "end_time": "09:30"},
+        ]
+        self.exceptions = [{"date_start": "09.01.2023", "date_end": "09.01.2023"}]
+        self.index = OccurrenceIndex(self.events, self.exceptions)
+
+    def pairs(self, conflicts):
+        return [(conflict.start, conflict.first.summary, conflict.second.summary) for conflict in conflicts]
+
+    def test_conflicts(self):
+        self.assertEqual(self.pairs(self.index.conflicts(date(2023, 1, 1), date(2023, 1, 31))), [
+            (datetime(2023, 1, 2, 15, 30), "Piano", "Swimming"),
+            (datetime(2023, 1, 16, 15, 30), "Piano", "Swimming"),
+            (datetime(2023, 1, 19, 9, 0), "Ski camp", "Dentist"),
+        ])
+        conflict = next(self.index.conflicts(date(2023, 1, 2), date(2023, 1, 2)))
+        self.assertEqual(conflict.end, datetime(2023, 1, 2, 16, 0))
+        self.assertEqual(self.pairs(self.index.conflicts(date(2023, 1, 1), date(2023, 1, 31), all_day=False)),
+                         self.pairs(self.index.conflicts(date(2023, 1, 1), date(2023, 1, 17))))
+        # The camp runs into the window, but only overlaps the dentist before it
+        self.assertEqual(self.pairs(self.index.conflicts(date(2023, 1, 20), date(2023, 1, 31))), [])
+
+    def test_same_as_comparing_every_pair(self):
+        occurrences = []
+        for i in range(300):
+            start = datetime(2023, 1, 1) + timedelta(minutes=i * 97 % 2000)
+            if i % 25 == 0:
+                occurrences.append(Occurrence(start.date(), start.date() + timedelta(days=1 + i % 2), f"All day {i}", None, str(i)))
+            else:
+                occurrences.append(Occurrence(start, start + timedelta(minutes=i % 90), f"Timed {i}", None, str(i)))
+        occurrences.sort(key=generate_ics.occurrence_key)
+        intervals = [generate_ics.occurrence_interval(occurrence) for occurrence in occurrences]
+        expected = {(a.uid, b.uid) for i, a in enumerate(occurrences) for j, b in enumerate(occurrences)
+                    if i < j and intervals[i][0] < intervals[j][1] and intervals[j][0] < intervals[i][1]}
+        found = [(conflict.first.uid, conflict.second.uid) for conflict in find_conflicts(occurrences)]
+        self.assertEqual(len(found), len(expected))
+        self.assertEqual(set(found), expected)
+
+    def test_cli(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        input_file = os.path.join(tmp_dir, "events.json")
+        with open(input_file, "w", encoding="utf-8") as f:
+            json.dump({"events": self.events, "exceptions": self.exceptions}, f)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            main(["query", input_file, "--from", "01.01.2023", "--conflicts", "--timed-only", "--csv"])
+        rows = list(csv.reader(io.StringIO(output.getvalue())))
+        self.assertEqual(rows[0][:3], ["overlap_start", "overlap_end", "first_summary"])
+        # Piano is open-ended: without --to, it is checked for a year
+        self.assertEqual([(row[0], row[2], row[6]) for row in rows[1:]], [
+            ("2023-01-02T15:30:00", "Piano", "Swimming"),
+            ("2023-01-16T15:30:00", "Piano", "Swimming"),
+        ])
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            main(["query", input_file, "--from", "19.01.2023", "--conflicts", "--json"])
+        conflicts = json.loads(output.getvalue())
+        self.assertEqual([(c["first"]["summary"], c["second"]["summary"]) for c in conflicts], [("Ski camp", "Dentist")])
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file